@@ -0,0 +1,336 @@
+"""
+Benchmark how the ClimRR visualizers scale with the number of selected grid cells.
+
+For each grid size, a synthetic table of every climrr.yml dataset and a
+synthetic grid are written to a temporary directory, the whole grid is
+selected and each visualizer's `analyze` runs against a stubbed Streamlit
+and streamlit_folium. Every stage gets its own time (excluding the stages
+nested in it) and its peak traced memory (including them):
+
+    load       building the visualizer and loading its dataset
+    select     gathering the values of the selected cells
+    stats      mean and standard deviation of every column
+    join       joining the selection's geometry with its values
+    color      color (and class) columns of the maps
+    map        building the folium maps
+    serialize  rendering the maps to HTML, as st_folium does
+    legend     drawing the legends
+    figures    the meta-analysis figures
+    prompts    the display tables and chat prompts
+
+Results are written as JSON; pass an earlier result file as --baseline to
+list the stages that got slower or heavier. Run from the repository root:
+    python -m benchmarks.climrr_visualizers --output ./output/benchmarks/climrr.json
+    python -m benchmarks.climrr_visualizers --sizes 200000 --keywords 'Wind Speed projections' --no-memory
+"""
+import os
+import sys
+import json
+import time
+import warnings
+import math
+import argparse
+import platform
+import tempfile
+import functools
+import subprocess
+import tracemalloc
+from contextlib import ExitStack, contextmanager, nullcontext
+from collections import defaultdict
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from src.data_vis import dispatch_analyze_fn
+from src.data_vis import climrr
+from src.data_vis.climrr_store import load_climrr_config, parquet_path, write_stats, compute_changes
+from src.data_vis.climrr_cache import clear_datasets, map_cache, result_cache
+
+STAGES = ['load', 'select', 'stats', 'join', 'color', 'map', 'serialize', 'legend', 'figures', 'prompts']
+# Visualizer methods timed as each stage; subclasses calling super() count once.
+STAGE_METHODS = {
+    'select': ['select'],
+    'stats': ['calculate_statistics', 'calculate_changes', 'find_hotspots'],
+    'join': ['join_selection'],
+    'color': ['map_columns'],
+    'map': ['get_map', 'add_hotspots'],
+    'legend': ['add_legend'],
+    'figures': ['create_figures'],
+    'prompts': ['create_tables', 'create_messages'],
+}
+# Side of a synthetic grid cell in meters, about the 12 km of the ClimRR grid.
+CELL_SIZE = 12000
+
+
+class StageRecorder:
+    """
+    Accumulate the time and peak memory of nested stages.
+
+    A stage's time excludes the stages nested in it; its peak is the largest
+    amount of traced memory allocated above what was in use when it started,
+    nested stages included. Memory is only recorded while tracemalloc runs.
+    """
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.peak_bytes = defaultdict(int)
+        self.stack = []
+
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        frame = {'children': 0.0, 'base': 0, 'peak': 0}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = frame['peak'] = current
+        self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            self.seconds[name] += elapsed - frame['children']
+            if tracing:
+                frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                self.peak_bytes[name] = max(self.peak_bytes[name], frame['peak'] - frame['base'])
+            if self.stack:
+                self.stack[-1]['children'] += elapsed
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], frame['peak'])
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return timed
+
+
+class SessionState(dict):
+    """A dict with attribute access, like st.session_state."""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class StubStreamlit:
+    """Stands in for streamlit: widgets return their first option, layout and output calls do nothing."""
+    def __init__(self, center, zoom):
+        self.session_state = SessionState(center=center, zoom=zoom)
+
+    def columns(self, spec, **kwargs):
+        return [nullcontext() for _ in range(spec if isinstance(spec, int) else len(spec))]
+
+    def radio(self, label, options, **kwargs):
+        return options[0]
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def synthetic_grid(n_cells, crs='EPSG:5070'):
+    """Return a square-ish grid of `n_cells` cells named R<row>C<col>, like the ClimRR grid."""
+    n_cols = math.ceil(math.sqrt(n_cells))
+    index = np.arange(n_cells)
+    rows, cols = index // n_cols + 1, index % n_cols + 1
+    x0, y0 = -2.3e6 + (cols - 1) * CELL_SIZE, 0.3e6 + (rows - 1) * CELL_SIZE
+    geometry = shapely.box(x0, y0, x0 + CELL_SIZE, y0 + CELL_SIZE)
+    crossmodels = [f'R{r}C{c}' for r, c in zip(rows, cols)]
+    return gpd.GeoDataFrame({'Crossmodel': crossmodels}, geometry=geometry, crs=crs)
+
+
+def write_synthetic_tables(config, crossmodels, seed=0):
+    """
+    Write a Parquet table and statistics sidecar with random values for every dataset of climrr.yml.
+
+    Paths are the ones of climrr.yml, relative to the working directory.
+    Datasets sharing a file get one table with all of their columns, followed
+    by their change columns as the data preparation step writes them.
+    """
+    rng = np.random.default_rng(seed)
+    columns_by_path = defaultdict(list)
+    infos_by_path = defaultdict(list)
+    for data_info in config.values():
+        columns_by_path[data_info['path']] += [col for col in data_info['values_of_interests'] if col not in columns_by_path[data_info['path']]]
+        infos_by_path[data_info['path']].append(data_info)
+    for path, columns in columns_by_path.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df = pd.DataFrame(rng.gamma(2.0, 15.0, (len(crossmodels), len(columns))).round(3), columns=columns)
+        df = pd.concat([df] + [compute_changes(df, data_info) for data_info in infos_by_path[path]], axis=1)
+        df = df.loc[:, ~df.columns.duplicated()]
+        df.insert(0, 'Crossmodel', crossmodels)
+        df.to_parquet(parquet_path(path), index=False)
+        write_stats(df, {'path': path, 'values_of_interests': columns}, list(df.columns.drop('Crossmodel')))
+
+
+@contextmanager
+def stubbed_app(recorder, center, zoom, render_plots=False):
+    """Run the visualizers against a stub of Streamlit whose st_folium renders the map to HTML."""
+    def st_folium(m, **kwargs):
+        with recorder.stage('serialize'):
+            m.get_root().render()
+
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(climrr, 'st', StubStreamlit(center, zoom)))
+        stack.enter_context(mock.patch.object(climrr, 'streamlit_folium', SimpleNamespace(st_folium=st_folium)))
+        if not render_plots:
+            # kaleido needs a headless browser; leave image rendering out unless asked for
+            stack.enter_context(mock.patch.object(climrr, 'plot_rendering', SimpleNamespace(render_figures=lambda figs, format='png': [])))
+        yield
+
+
+def run_visualizer(keyword, selection, recorder, center, zoom, render_plots=False):
+    """Run the analysis of one dataset from a cold start, recording its stages."""
+    clear_datasets()
+    map_cache.clear()
+    result_cache.clear()
+    with stubbed_app(recorder, center, zoom, render_plots):
+        with recorder.stage('load'):
+            analyze = dispatch_analyze_fn([keyword])[keyword]
+        visualizer = analyze.__self__
+        for stage, methods in STAGE_METHODS.items():
+            for method in methods:
+                setattr(visualizer, method, recorder.wrap(stage, getattr(visualizer, method)))
+        analyze(selection)
+
+
+def benchmark(keyword, selection, repeat, memory, center, zoom, render_plots=False):
+    """Return {stage: (seconds, peak bytes)}; times are the best of `repeat` runs, memory comes from one extra traced run."""
+    seconds = {}
+    for _ in range(repeat):
+        recorder = StageRecorder()
+        run_visualizer(keyword, selection, recorder, center, zoom, render_plots)
+        for stage, value in recorder.seconds.items():
+            seconds[stage] = min(seconds.get(stage, value), value)
+    peak_bytes = {}
+    if memory:
+        # tracing slows allocation-heavy code down, so it gets a run of its own
+        recorder = StageRecorder()
+        tracemalloc.start()
+        try:
+            run_visualizer(keyword, selection, recorder, center, zoom, render_plots)
+        finally:
+            tracemalloc.stop()
+        peak_bytes = dict(recorder.peak_bytes)
+    return {stage: (seconds[stage], peak_bytes.get(stage)) for stage in STAGES if stage in seconds}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, keywords, repeat=1, memory=True, center=(38.0, -96.0), zoom=6, render_plots=False):
+    """Benchmark every dataset at every grid size and return the result records."""
+    config = load_climrr_config()
+    records = []
+    cwd = os.getcwd()
+    for n_cells in sizes:
+        grid = synthetic_grid(n_cells)
+        with tempfile.TemporaryDirectory() as root:
+            os.chdir(root)
+            try:
+                write_synthetic_tables(config, grid['Crossmodel'])
+                if n_cells == sizes[0]:
+                    # a discarded run of every dataset, so lazily imported libraries are not charged to the first one
+                    for keyword in keywords:
+                        run_visualizer(keyword, grid.head(16), StageRecorder(), list(center), zoom, render_plots)
+                for keyword in keywords:
+                    layout = 'seasonal' if config[keyword].get('season', False) else 'annual'
+                    stages = benchmark(keyword, grid, repeat, memory, list(center), zoom, render_plots)
+                    for stage, (seconds, peak_bytes) in stages.items():
+                        records.append({'keyword': keyword, 'layout': layout, 'cells': n_cells, 'stage': stage,
+                                        'seconds': seconds, 'peak_bytes': peak_bytes})
+                    total = sum(seconds for seconds, _ in stages.values())
+                    print(f"{n_cells:>8} {layout:<9} {keyword:<45} {total:9.3f}s", flush=True)
+            finally:
+                os.chdir(cwd)
+                clear_datasets()
+    return records
+
+
+def report(records):
+    table = pd.DataFrame(records)
+    seconds = table.pivot_table(index=['cells', 'layout'], columns='stage', values='seconds', aggfunc='sum')
+    print("\nSeconds per stage, summed over datasets")
+    print(seconds[[stage for stage in STAGES if stage in seconds.columns]].round(3).to_string())
+    if table['peak_bytes'].notna().any():
+        peak = table.pivot_table(index=['cells', 'layout'], columns='stage', values='peak_bytes', aggfunc='max') / 1024 ** 2
+        print("\nLargest peak memory per stage [MiB]")
+        print(peak[[stage for stage in STAGES if stage in peak.columns]].round(1).to_string())
+
+
+def find_regressions(records, baseline, tolerance=0.25, min_seconds=0.005, min_bytes=1024 ** 2):
+    """Return (keyword, cells, stage, metric, before, after) for every measurement more than `tolerance` above the baseline."""
+    before = {(r['keyword'], r['cells'], r['stage']): r for r in baseline}
+    regressions = []
+    for record in records:
+        old = before.get((record['keyword'], record['cells'], record['stage']))
+        if old is None:
+            continue
+        for metric, floor in [('seconds', min_seconds), ('peak_bytes', min_bytes)]:
+            if record[metric] is None or old[metric] is None:
+                continue
+            # small absolute changes are noise, whatever the ratio
+            if record[metric] > old[metric] * (1 + tolerance) and record[metric] - old[metric] > floor:
+                regressions.append((record['keyword'], record['cells'], record['stage'], metric, old[metric], record[metric]))
+    return regressions
+
+
+if __name__ == "__main__":
+    # pandas' chained-assignment warnings of the visualizers would drown the report
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+    config = load_climrr_config()
+    parser = argparse.ArgumentParser(description='Benchmark the ClimRR visualizers on synthetic grids')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Numbers of grid cells, all of them selected')
+    parser.add_argument('--keywords', type=str, nargs='+', default=list(config), help='climrr.yml datasets to benchmark')
+    parser.add_argument('--layouts', type=str, nargs='+', choices=['seasonal', 'annual'], default=['seasonal', 'annual'], help='Only benchmark datasets with these layouts')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of timed runs; the fastest time of each stage is kept')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced run measuring peak memory')
+    parser.add_argument('--zoom', type=int, default=6, help='Map zoom level, which picks the geometry tier')
+    parser.add_argument('--map-mode', type=str, choices=['geojson', 'tiles', 'layers'], default=climrr.MAP_MODE, help='How the maps draw the cells (CLIMRR_MAP_MODE)')
+    parser.add_argument('--render-plots', action='store_true', help='Also render the figures to images with kaleido')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to write the results to')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier result file to compare against; exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative increase over the baseline reported as a regression')
+    args = parser.parse_args()
+    unknown = set(args.keywords) - set(config)
+    if unknown:
+        parser.error(f"unknown datasets: {', '.join(sorted(unknown))}")
+    climrr.MAP_MODE = args.map_mode
+    keywords = [k for k in args.keywords if ('seasonal' if config[k].get('season', False) else 'annual') in args.layouts]
+
+    records = run(args.sizes, keywords, args.repeat, not args.no_memory, zoom=args.zoom, render_plots=args.render_plots)
+    report(records)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        result = {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'map_mode': args.map_mode,
+            'repeat': args.repeat,
+            'records': records,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(records, json.load(f)['records'], args.tolerance)
+        print(f"\n{len(regressions)} regressions against {args.baseline}")
+        for keyword, cells, stage, metric, old, new in regressions:
+            print(f"  {keyword} @ {cells} cells, {stage} {metric}: {old:.4g} -> {new:.4g}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,68 @@
+"""
+Benchmark the Crossmodel-indexed `convert_to_dataframe` against the previous
+per-cell boolean scan.
+
+Run from the repository root:
+    python -m benchmarks.convert_to_dataframe --sizes 100 10000 100000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from src.data_vis.climrr_utils import convert_to_dataframe, index_by_crossmodel
+
+
+def scan_convert_to_dataframe(df, values_of_interests, crossmodels):
+    """The previous implementation: one full-table scan per selected cell."""
+    data_dict = {}
+    for crossmodel in crossmodels['Crossmodel']:
+        data_dict[crossmodel] = df[df['Crossmodel'] == crossmodel].iloc[0]
+    data_rows = [[crossmodel] + [values[key] for key in values_of_interests] for crossmodel, values in data_dict.items()]
+    return pd.DataFrame(data_rows, columns=['Crossmodel'] + values_of_interests)
+
+
+def synthetic_table(n_cells, n_columns, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = [f'value_{i}' for i in range(n_columns)]
+    df = pd.DataFrame(rng.normal(size=(n_cells, n_columns)), columns=columns)
+    df['Crossmodel'] = [f'R{i // 1000}C{i % 1000}' for i in range(n_cells)]
+    return df, columns
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def run(sizes, n_cells, n_columns, scan_limit, sample):
+    df, columns = synthetic_table(n_cells, n_columns)
+    indexed = index_by_crossmodel(df)
+    rng = np.random.default_rng(1)
+    print(f"{'selected':>10} {'scan (s)':>12} {'indexed (s)':>12} {'speedup':>10}")
+    for size in sizes:
+        crossmodels = pd.DataFrame({'Crossmodel': rng.choice(df['Crossmodel'].values, size, replace=False)})
+        indexed_time, result = timed(convert_to_dataframe, indexed, columns, crossmodels)
+        if size <= scan_limit:
+            scan_time, expected = timed(scan_convert_to_dataframe, df, columns, crossmodels)
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+            label = f"{scan_time:12.4f}"
+        else:
+            # the scan is linear in the selection size, so extrapolate from a sample
+            sample_time, _ = timed(scan_convert_to_dataframe, df, columns, crossmodels.head(sample))
+            scan_time = sample_time * size / sample
+            label = f"{scan_time:11.1f}*"
+        print(f"{size:>10} {label} {indexed_time:12.4f} {scan_time / indexed_time:9.0f}x")
+    if any(size > scan_limit for size in sizes):
+        print(f"* extrapolated from a {sample}-cell sample")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark convert_to_dataframe')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000], help='Numbers of selected cells')
+    parser.add_argument('--cells', type=int, default=120000, help='Number of rows in the synthetic ClimRR table')
+    parser.add_argument('--columns', type=int, default=12, help='Number of value columns')
+    parser.add_argument('--scan-limit', type=int, default=10000, help='Largest selection timed with the full per-cell scan')
+    parser.add_argument('--sample', type=int, default=1000, help='Sample size used to extrapolate the scan above the limit')
+    args = parser.parse_args()
+    run(args.sizes, args.cells, args.columns, args.scan_limit, args.sample)
@@ -0,0 +1,63 @@
+"""
+Report which modules dominate the cold-start import time of a module.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+sums the self time of every imported module by top-level package.
+
+Run from the repository root:
+    python -m benchmarks.import_time src.data_vis --top 15
+"""
+import os
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+
+def import_times(module, preload=()):
+    """
+    Return (self microseconds, cumulative microseconds, module name) for every module imported by `module`.
+
+    Modules in `preload` are imported first and left out of the report, e.g.
+    streamlit, which every page of the app has already imported.
+    """
+    statements = [f'import {name}' for name in preload] + [f'import {module}']
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, ['.', os.environ.get('PYTHONPATH')])))
+    if preload:
+        # -X importtime cannot be switched on mid-run, so report only the lines after the preloads
+        code = '; '.join(statements[:-1]) + "; import sys; sys.stderr.write('--preloaded--\\n'); " + statements[-1]
+    else:
+        code = statements[-1]
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                               capture_output=True, text=True, check=True)
+    lines = completed.stderr.splitlines()
+    if preload:
+        lines = lines[lines.index('--preloaded--') + 1:]
+    times = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((int(self_us), int(cumulative_us), name.strip()))
+    return times
+
+
+def report(module, top=15, preload=()):
+    times = import_times(module, preload)
+    total = next(cumulative for _, cumulative, name in times if name == module)
+    by_package = defaultdict(int)
+    for self_us, _, name in times:
+        by_package[name.split('.')[0]] += self_us
+    print(f"import {module}: {total / 1e6:.3f}s, {len(times)} modules")
+    print(f"{'package':<30} {'self time [s]':>14} {'share':>7}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<30} {self_us / 1e6:14.3f} {self_us / total:7.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Report the import time of a module by top-level package')
+    parser.add_argument('module', type=str, nargs='?', default='src.data_vis', help='Module to import')
+    parser.add_argument('--top', type=int, default=15, help='Number of packages to list')
+    parser.add_argument('--preload', type=str, nargs='*', default=['streamlit'], help='Modules already imported by the app, left out of the report')
+    args = parser.parse_args()
+    report(args.module, args.top, args.preload)
@@ -1,30 +1,62 @@
-from src.data_vis.wildfire_perimeters import analyze_wildfire_perimeters
-from src.data_vis.census import analyze_census_data
-from src.data_vis.climrr import *
+import importlib
 from functools import partial
 
+# Public names of the package and the submodule defining each; submodules are
+# only imported when one of their names is first used.
+_EXPORTS = {
+    'analyze_wildfire_perimeters': 'src.data_vis.wildfire_perimeters',
+    'analyze_census_data': 'src.data_vis.census',
+    'AnalysisResult': 'src.data_vis.climrr',
+    'DataVisualizer': 'src.data_vis.climrr',
+    'ClimRRSeasonalProjectionsFWI': 'src.data_vis.climrr',
+    'ClimRRSeasonalProjectionsTemperature': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsTemperature': 'src.data_vis.climrr',
+    'ClimRRDailyProjectionsPrecipitation': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsPrecipitation': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsCDNP': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsWindSpeed': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsCoolingDegreeDays': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsHeatingDegreeDays': 'src.data_vis.climrr',
+    'ClimRRAnnualProjectionsHeatIndex': 'src.data_vis.climrr',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
+
+
 def dispatch_analyze_fn(keywords):
     dispatch_dict = {
-        'Fire Weather Index (FWI) projections': ClimRRSeasonalProjectionsFWI,
-        'Seasonal Temperature Maximum projections': partial(ClimRRSeasonalProjectionsTemperature, "Maximum"),
-        'Seasonal Temperature Minimum projections': partial(ClimRRSeasonalProjectionsTemperature, "Minimum"),
-        'Annual Temperature Maximum projections': partial(ClimRRAnnualProjectionsTemperature, "Maximum"),
-        'Annual Temperature Minimum projections': partial(ClimRRAnnualProjectionsTemperature, "Minimum"),
-        'Daily Precipitation Max projections': partial(ClimRRDailyProjectionsPrecipitation, "Max"),
-        'Daily Precipitation Mean projections': partial(ClimRRDailyProjectionsPrecipitation, "Mean"),
-        'Precipitation projections': ClimRRAnnualProjectionsPrecipitation,
-        'Consecutive Dry Days projections': ClimRRAnnualProjectionsCDNP,
-        'Wind Speed projections': ClimRRAnnualProjectionsWindSpeed,
-        'Cooling Degree Days projections': ClimRRAnnualProjectionsCoolingDegreeDays,
-        'Heating Degree Days projections': ClimRRAnnualProjectionsHeatingDegreeDays,
-        'Heat Index projections': ClimRRAnnualProjectionsHeatIndex,
-        'Census data': analyze_census_data,
-        'Recent Fire Perimeters data': analyze_wildfire_perimeters
+        'Fire Weather Index (FWI) projections': ('ClimRRSeasonalProjectionsFWI',),
+        'Seasonal Temperature Maximum projections': ('ClimRRSeasonalProjectionsTemperature', "Maximum"),
+        'Seasonal Temperature Minimum projections': ('ClimRRSeasonalProjectionsTemperature', "Minimum"),
+        'Annual Temperature Maximum projections': ('ClimRRAnnualProjectionsTemperature', "Maximum"),
+        'Annual Temperature Minimum projections': ('ClimRRAnnualProjectionsTemperature', "Minimum"),
+        'Daily Precipitation Max projections': ('ClimRRDailyProjectionsPrecipitation', "Max"),
+        'Daily Precipitation Mean projections': ('ClimRRDailyProjectionsPrecipitation', "Mean"),
+        'Precipitation projections': ('ClimRRAnnualProjectionsPrecipitation',),
+        'Consecutive Dry Days projections': ('ClimRRAnnualProjectionsCDNP',),
+        'Wind Speed projections': ('ClimRRAnnualProjectionsWindSpeed',),
+        'Cooling Degree Days projections': ('ClimRRAnnualProjectionsCoolingDegreeDays',),
+        'Heating Degree Days projections': ('ClimRRAnnualProjectionsHeatingDegreeDays',),
+        'Heat Index projections': ('ClimRRAnnualProjectionsHeatIndex',),
+        'Census data': ('analyze_census_data',),
+        'Recent Fire Perimeters data': ('analyze_wildfire_perimeters',)
     }
+    # the ClimRR datasets are loaded, and their selections gathered, together
+    climrr_keywords = [keyword for keyword in keywords if 'projections' in keyword]
+    if climrr_keywords:
+        from src.data_vis.climrr_selection import shared_selection_loader
+        selection_loader = shared_selection_loader(climrr_keywords)
     analyze_fn_dict = {}
     for keyword in keywords:
+        name, *args = dispatch_dict[keyword]
         if 'projections' in keyword:
-            analyze_fn_dict[keyword] = dispatch_dict[keyword]().analyze
+            visualizer = partial(__getattr__(name), *args)()
+            visualizer.selection_loader = selection_loader
+            analyze_fn_dict[keyword] = visualizer.analyze
         else:
-            analyze_fn_dict[keyword] = dispatch_dict[keyword]
-    return analyze_fn_dict
\ No newline at end of file
+            analyze_fn_dict[keyword] = __getattr__(name)
+    return analyze_fn_dict
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import geopandas as gpd
+from src.data_vis.climrr_store import CONFIG_PATH, load_climrr_config
+from src.data_vis.climrr_selection import SelectionLoader
+from src.data_vis.climrr_geometry import GRID_PATH
+from src.data_vis.climrr_utils import dataset_slug
+
+
+def select_cells(regions, grid):
+    """
+    Return the Crossmodel IDs of the grid cells intersecting each region, keyed by region ID.
+
+    Cells are selected the same way as for a drawing in the app, with one
+    spatial join for all regions.
+    """
+    regions = regions.to_crs(grid.crs)
+    joined = gpd.sjoin(grid[['Crossmodel', 'geometry']], regions[['geometry']], how='inner', predicate='intersects')
+    cells = joined.groupby('index_right')['Crossmodel'].unique()
+    return {region_id: list(cells.get(region_id, [])) for region_id in regions.index}
+
+
+def region_dir_name(region_id):
+    """
+    Return the folder name of a region: the slug of its ID followed by a short hash of the ID itself.
+
+    Slugs alone can collide ('St. Louis' and 'St Louis') or be empty (names
+    without ASCII letters or digits), so the hash keeps distinct IDs apart.
+    """
+    digest = hashlib.sha1(str(region_id).encode('utf8')).hexdigest()[:8]
+    return f"{dataset_slug(str(region_id)) or 'region'}_{digest}"
+
+
+def json_statistics(values):
+    """Return per-column statistics as a dict for json.dump, None for the NaN of columns without values."""
+    return {col: None if pd.isna(value) else float(value) for col, value in values.items()}
+
+
+def analyze_region(region_id, crossmodels, keywords, output_dir, format='parquet', config_path=CONFIG_PATH):
+    """
+    Write the selection table of every dataset and a summary of their statistics for one region.
+
+    The summary, <output_dir>/<region>/summary.json with the folder named by
+    region_dir_name, holds the region ID, the number of selected cells and
+    the mean and standard deviation of each value column, as shown in the
+    app's meta-analysis. Selection tables are written next to it as
+    <dataset>.parquet or <dataset>.json. Regions covering no grid cell get
+    empty tables and a summary with no statistics.
+    """
+    loader = SelectionLoader(keywords, config_path)
+    region_dir = os.path.join(output_dir, region_dir_name(region_id))
+    os.makedirs(region_dir, exist_ok=True)
+    selection = pd.DataFrame({'Crossmodel': pd.Series(crossmodels, dtype=object)})
+    summary = {'region': str(region_id), 'cells': len(crossmodels), 'datasets': {}}
+    for keyword in keywords:
+        data_info = loader.data_infos[keyword]
+        df = loader.select(keyword, selection)
+        values = df.drop(columns='Crossmodel')
+        summary['datasets'][keyword] = {
+            'title': data_info['title'],
+            'mean': json_statistics(values.mean()),
+            'std': json_statistics(values.std()),
+        }
+        table_path = os.path.join(region_dir, f'{dataset_slug(keyword)}.{format}')
+        if format == 'parquet':
+            df.to_parquet(table_path, index=False)
+        else:
+            df.to_json(table_path, orient='records')
+    with open(os.path.join(region_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return region_dir
+
+
+def run_batch(regions_path, keywords, output_dir, grid_path=GRID_PATH, id_column=None, workers=None, format='parquet'):
+    """Analyze every region of a geometry file on a pool of worker processes and return the output directories."""
+    regions = gpd.read_file(regions_path)
+    if id_column is not None:
+        regions = regions.set_index(id_column)
+    names = pd.Series([region_dir_name(region_id) for region_id in regions.index], index=regions.index)
+    if names.duplicated().any():
+        clashes = sorted(map(str, names.index[names.duplicated(keep=False)]))
+        raise ValueError(f"Regions would share an output folder (duplicate IDs?): {clashes[:10]}")
+    grid = gpd.read_file(grid_path)
+    cells = select_cells(regions, grid)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(analyze_region, region_id, crossmodels, keywords, output_dir, format)
+                   for region_id, crossmodels in cells.items()]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    config = load_climrr_config()
+    parser = argparse.ArgumentParser(description='Write ClimRR statistics and selection tables for many regions')
+    parser.add_argument('regions', type=str, help='Geometry file (GeoJSON, shapefile, ...) with one region per feature')
+    parser.add_argument('--keywords', type=str, nargs='+', default=list(config), help='climrr.yml datasets to analyze')
+    parser.add_argument('--grid', type=str, default=GRID_PATH, help='Grid cells shapefile')
+    parser.add_argument('--id-column', type=str, default=None, help='Column naming each region; the row number by default')
+    parser.add_argument('--output-dir', type=str, default='./output/climrr_batch', help='Directory to write one folder per region to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--format', type=str, choices=['parquet', 'json'], default='parquet', help='Format of the selection tables')
+    args = parser.parse_args()
+    unknown = set(args.keywords) - set(config)
+    if unknown:
+        parser.error(f"unknown datasets: {', '.join(sorted(unknown))}")
+    outputs = run_batch(args.regions, args.keywords, args.output_dir, args.grid, args.id_column, args.workers, args.format)
+    print(f"Wrote {len(outputs)} regions to {args.output_dir}")
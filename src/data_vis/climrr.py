@@ -1,59 +1,368 @@
 from abc import ABC, abstractmethod
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
-import geopandas as gpd
 import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+import numpy as np
 import io
+import os
+import json
 import base64
-from src.utils import load_config
-from src.data_vis.climrr_utils import convert_to_dataframe, categorize_fwi, fwi_color
-import plotly.io as pio
-import contextily as ctx
+import threading
+from src.utils import LazyModule
+from src.data_vis.climrr_utils import convert_to_dataframe, selection_hash, categorize_fwi, categorize_fwi_array, fwi_colors, colormap_hex, hotspots, FWI_BINS, FWI_CLASSES, FWI_CLASS_COLORS
+from src.data_vis.climrr_cube import AXES
+from src.data_vis.climrr_store import load_climrr_config, has_changes, changes_info, change_names
+from src.data_vis.climrr_cache import get_dataset, get_datasets, map_cache, result_cache
+from src.data_vis.climrr_stats import RunningStatistics
+from src.data_vis.climrr_pyramid import PYRAMID_MIN_CELLS
+
+# Plotting, mapping and geometry libraries are only imported once a visualizer uses them.
+folium = LazyModule('folium')
+streamlit_folium = LazyModule('streamlit_folium')
+gpd = LazyModule('geopandas')
+px = LazyModule('plotly.express')
+plt = LazyModule('matplotlib.pyplot')
+mcolors = LazyModule('matplotlib.colors')
+climrr_geometry = LazyModule('src.data_vis.climrr_geometry')
+climrr_layers = LazyModule('src.data_vis.climrr_layers')
+climrr_tiles = LazyModule('src.data_vis.climrr_tiles')
+climrr_raster = LazyModule('src.data_vis.climrr_raster')
+plot_rendering = LazyModule('src.data_vis.plot_rendering')
+
+# Border style of the cells in the annual maps; seasonal maps outline cells in their fill color.
+ANNUAL_OUTLINE = {'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
+# Leaflet's default path style, which the seasonal maps draw with.
+DEFAULT_OUTLINE = {'color': None, 'weight': 3, 'opacity': 1.0, 'fillOpacity': 0.2}
+# 'geojson' inlines the selected cells in every map; 'tiles' draws them from the
+# local vector tile server for datasets whose tile cache was built; 'layers'
+# draws each section as one map whose periods and seasons are switched in the browser.
+MAP_MODE = os.environ.get('CLIMRR_MAP_MODE', 'geojson')
+# Captions of the first, second and third period of a dataset.
+PERIOD_CAPTIONS = ['Historical', 'Mid-century', 'End-century']
+# Selections of at least this many cells are drawn as one raster image instead
+# of a polygon per cell; the values of a cell are shown when it is clicked.
+RASTER_MIN_CELLS = int(os.environ.get('CLIMRR_RASTER_MIN_CELLS', 5000))
+# Number of hotspot cells listed in the prompts and circled on the maps.
+HOTSPOT_CELLS = int(os.environ.get('CLIMRR_HOTSPOT_CELLS', 10))
+
+class AnalysisResult:
+    """
+    Everything an analysis computes for a selection of grid cells, independent of Streamlit.
+
+    `df` is the selection table, `mean`/`std` the statistics of each value
+    column, `figures` the plotly figures of the meta-analysis and `plots`
+    their base64 PNG images for multimodal analysis. `tables` maps a name to
+    each display table, including 'changes' when the dataset has change
+    columns (see calculate_changes) and the 'hotspots' of find_hotspots;
+    `messages` and `code_messages` (None
+    for datasets without a coding prompt) are the chat prompts built from
+    them.
+    """
+    def __init__(self, keyword, df, mean, std, figures, plots, tables, messages, code_messages=None):
+        self.keyword = keyword
+        self.df = df
+        self.mean = mean
+        self.std = std
+        self.figures = figures
+        self.plots = plots
+        self.tables = tables
+        self.messages = messages
+        self.code_messages = code_messages
+
+    def with_own_messages(self):
+        """Return a copy of the result with its own prompt lists, which the caller may extend; the rest is shared."""
+        copy = AnalysisResult.__new__(AnalysisResult)
+        copy.__dict__.update(self.__dict__)
+        copy.messages = [dict(message) for message in self.messages]
+        if self.code_messages is not None:
+            copy.code_messages = [dict(message) for message in self.code_messages]
+        return copy
 
-config = load_config('src/data_vis/climrr.yml')
 
 class DataVisualizer(ABC):
+    # whether the meta-analysis figures are also rendered to images for multimodal analysis
+    plot_images = True
+    # SelectionLoader shared by the datasets analyzed together, set by dispatch_analyze_fn
+    selection_loader = None
+
+
     def __init__(self, keyword):
         self.keyword = keyword
-        self.data_info = config[keyword]
+        self.data_info = load_climrr_config()[keyword]
         self.path = self.data_info['path']
         self.values_of_interests = self.data_info['values_of_interests']
-        self.df = self.initialize_data()
-        self.min_value = self.df[self.values_of_interests].min().min()
-        self.max_value = self.df[self.values_of_interests].max().max()
+        # loaded frames and their value range are shared across sessions and reruns
+        self.dataset = self.initialize_data()
+        self.df = self.dataset.df
+        self.min_value = self.dataset.min_value
+        # period/season/scenario/variable labels of every value column
+        self.cube = self.dataset.cube(self.data_info['periods'])
+        self.max_value = self.dataset.max_value
         self.color_scale = self.create_color_scale()
-        # save visual data for multimodal analysis
-        self.plots = []
+        self.map_mode = MAP_MODE
 
     def initialize_data(self):
-        df = pd.read_csv(self.path)
-        return df[self.values_of_interests + ['Crossmodel']]
+        return get_dataset(self.path, self.values_of_interests)
 
     @abstractmethod
     def create_color_scale(self):
         pass
 
+    def select(self, crossmodels):
+        """Return the values of interest for the selected grid cells, from the shared SelectionLoader when there is one."""
+        if self.selection_loader is not None:
+            return self.selection_loader.select(self.keyword, crossmodels)
+        return convert_to_dataframe(self.df, self.values_of_interests, crossmodels)
+
+    def join_selection(self, crossmodels, df):
+        """
+        Join the geometry of the selected cells with every value column of the selection.
+
+        Built once per analysis: the geometry is switched to the simplified tier
+        of the current zoom level and to EPSG:4326, and the map columns of each
+        value column (see map_columns) are precomputed, so every map of the
+        analysis only picks columns from the joined frame. With a SelectionLoader,
+        the display geometry is shared by every dataset of the selection.
+        """
+        if self.selection_loader is not None:
+            joined = self.selection_loader.join(crossmodels, df, st.session_state.zoom)
+        else:
+            joined = gpd.GeoDataFrame(crossmodels[['Crossmodel', 'geometry']].merge(df, on='Crossmodel'), crs=crossmodels.crs)
+            joined = climrr_geometry.with_zoom_geometry(joined, st.session_state.zoom).to_crs('EPSG:4326')
+        derived = {}
+        for col in df.columns.drop('Crossmodel'):
+            derived.update({f'{name}:{col}': values for name, values in self.map_columns(joined[col]).items()})
+        return joined.assign(**derived)
+
+    def map_columns(self, values):
+        """Return the columns a map of `values` needs besides the values, keyed by name."""
+        return {'color': self.get_colors(values)}
+
+    def map_frame(self, crossmodels, df, value_column):
+        """
+        Return the geo-frame drawing `value_column`, with its precomputed columns under their plain names.
+
+        `crossmodels` is normally the frame of join_selection, whose columns are
+        shared rather than copied; a plain selection of grid cells is joined first.
+        In 'layers' map mode, the other value columns of `df` are kept for the
+        map's other layers, with their precomputed columns under prefixed names.
+        """
+        layers = df.columns.drop('Crossmodel') if self.map_mode == 'layers' else [value_column]
+        if f'color:{value_column}' not in crossmodels.columns:
+            crossmodels = self.join_selection(crossmodels, df[['Crossmodel', *layers]])
+        columns = {'Crossmodel': crossmodels['Crossmodel'], value_column: crossmodels[value_column]}
+        for col in crossmodels.columns:
+            if col.endswith(f':{value_column}'):
+                columns[col.split(':')[0]] = crossmodels[col]
+        for layer in layers:
+            columns[layer] = crossmodels[layer]
+            columns.update({col: crossmodels[col] for col in crossmodels.columns if col.endswith(f':{layer}')})
+        columns['geometry'] = crossmodels.geometry
+        return gpd.GeoDataFrame(columns, copy=False)
+
     def get_color(self, value):
         normalized_value = (value - self.min_value) / (self.max_value - self.min_value)
         return mcolors.rgb2hex(self.color_scale(normalized_value))
 
+    def get_colors(self, values):
+        """Vectorized get_color: map a whole column of values to hex colors in one pass."""
+        normalized_values = (np.asarray(values, dtype=float) - self.min_value) / (self.max_value - self.min_value)
+        return colormap_hex(self.color_scale, normalized_values)
+
+    def color_function_js(self):
+        """Return a JavaScript function mapping a value to the same color as get_colors."""
+        n = self.color_scale.N
+        lookup = self.get_colors(self.min_value + (np.arange(n) + 0.5) / n * (self.max_value - self.min_value))
+        return f"""function(value) {{
+            var lookup = {json.dumps(list(lookup))};
+            var i = Math.floor((value - {self.min_value}) / ({self.max_value - self.min_value}) * {n});
+            return lookup[Math.min(Math.max(i, 0), {n - 1})];
+        }}"""
+
+    def create_map(self, geo_df, value_column, fields, aliases, outline=None):
+        """
+        Draw a geo-frame of map_frame, whose 'color' column holds the fill color of each cell.
+
+        Cells are drawn from the frame's geometry, spliced into the map as
+        pre-encoded GeoJSON (see SplicedGeoJson) and styled in the browser from
+        the precomputed color, or from the vector tiles of the dataset in 'tiles'
+        map mode. Without an `outline` style, cells are outlined in their fill color.
+        Selections of RASTER_MIN_CELLS cells or more are rasterized on the server
+        into a single image overlay, whose cost depends on the image size rather
+        than the number of cells; the map's `cell_lookup` replaces the tooltips.
+        """
+        if self.map_mode == 'layers':
+            return self.create_layer_map(geo_df, value_column, fields, aliases, outline)
+
+        if self.map_mode == 'tiles' and climrr_tiles.has_tile_cache(self.keyword):
+            m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
+            m.add_child(climrr_tiles.tile_layer(self.keyword, value_column, self.color_function_js(),
+                                   dict(DEFAULT_OUTLINE, **(outline or {})), geo_df['Crossmodel']))
+            return m
+
+        if len(geo_df) >= RASTER_MIN_CELLS:
+            m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
+            # cells outlined in their own color look solid once they are a few pixels wide
+            opacity = outline['fillOpacity'] if outline is not None else DEFAULT_OUTLINE['opacity']
+            m.add_child(climrr_raster.raster_layer(geo_df, opacity))
+            m.cell_lookup = climrr_raster.CellLookup(geo_df, fields, aliases)
+            return m
+
+        if not geo_df.crs.equals('EPSG:4326'):
+            geo_df = geo_df.to_crs('EPSG:4326')
+        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
+        m.add_child(
+            climrr_layers.SplicedGeoJson(geo_df, fields + ['color'], dict(DEFAULT_OUTLINE, **(outline or {})),
+                tooltip=folium.features.GeoJsonTooltip(fields=fields, aliases=aliases))
+        )
+        return m
+
+    def layer_labels(self, col):
+        """Return the period, season, scenario and variable labels of a column with their captions, skipping those it has none of."""
+        labels = {}
+        for axis, label in self.cube.labels[col].items():
+            if label is not None:
+                caption = PERIOD_CAPTIONS[self.data_info['periods'].index(label)] if axis == 'period' else label
+                labels[axis] = (label, caption)
+        return labels
+
+    def create_layer_map(self, geo_df, value_column, fields, aliases, outline=None):
+        """
+        Draw every value column of a 'layers' map_frame on one map, opening on `value_column` and switching between them in the browser.
+
+        The cells are embedded once with the values (and the other tooltip
+        fields) of every column as properties, and a LayerSwitch restyles them
+        with color_function_js when another period or season is picked.
+        Selections of RASTER_MIN_CELLS cells or more get one image overlay per
+        column instead, switched with a layer control; the cells are only
+        rasterized once for all of them.
+        """
+        columns = [col for col in geo_df.columns if f'color:{col}' in geo_df.columns]
+        layers = []
+        for col in columns:
+            names = [col if field == value_column else field if field == 'Crossmodel' else f'{field}:{col}' for field in fields]
+            layers.append({'column': col, 'labels': self.layer_labels(col), 'fields': names, 'aliases': aliases})
+        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
+
+        if len(geo_df) >= RASTER_MIN_CELLS:
+            opacity = outline['fillOpacity'] if outline is not None else DEFAULT_OUTLINE['opacity']
+            lookup_fields, lookup_aliases = ['Crossmodel'], ['Crossmodel']
+            for layer in layers:
+                col = layer['column']
+                name = ', '.join(caption for _, caption in layer['labels'].values())
+                frame = gpd.GeoDataFrame({'color': geo_df[f'color:{col}'], 'geometry': geo_df.geometry}, crs=geo_df.crs)
+                m.add_child(climrr_raster.raster_layer(frame, opacity, name=name, overlay=False, show=col == value_column))
+                lookup_fields += layer['fields'][1:]
+                lookup_aliases += [f'{name} {alias}' for alias in aliases[1:]]
+            folium.LayerControl(collapsed=False).add_to(m)
+            m.cell_lookup = climrr_raster.CellLookup(geo_df, lookup_fields, lookup_aliases)
+            return m
+
+        properties = list(dict.fromkeys(name for layer in layers for name in layer['fields']))
+        if not geo_df.crs.equals('EPSG:4326'):
+            geo_df = geo_df.to_crs('EPSG:4326')
+        cells = climrr_layers.SplicedGeoJson(geo_df, properties)
+        m.add_child(cells)
+        axes = []
+        for axis in AXES:
+            labels = list(dict.fromkeys(layer['labels'][axis] for layer in layers if axis in layer['labels']))
+            if len(labels) > 1:
+                axes.append({'axis': axis, 'labels': [{'value': value, 'caption': caption} for value, caption in labels]})
+        for layer in layers:
+            layer['labels'] = {axis: value for axis, (value, _) in layer['labels'].items()}
+        m.add_child(climrr_layers.LayerSwitch(cells, layers, axes, self.color_function_js(),
+                                              dict(DEFAULT_OUTLINE, **(outline or {})), columns.index(value_column)))
+        return m
+
+    def show_clicked_cell(self, m, output):
+        """Show the values of the last clicked cell of a raster map, which has no tooltips."""
+        lookup = getattr(m, 'cell_lookup', None)
+        clicked = (output or {}).get('last_clicked')
+        if lookup is None or not clicked:
+            return
+        cell = lookup.describe(clicked['lat'], clicked['lng'])
+        if cell is not None:
+            st.caption(' | '.join(f"{alias}: {value:.2f}" if isinstance(value, float) else f"{alias}: {value}"
+                                  for alias, value in cell.items()))
+
+    def show_map(self, m, **kwargs):
+        """
+        Draw a map of cached_map with st_folium, then the values of its last clicked cell.
+
+        Rendering mutates the map's Figure, so sessions drawing the same
+        cached map take turns through its lock.
+        """
+        with m.render_lock:
+            output = streamlit_folium.st_folium(m, **kwargs)
+        self.show_clicked_cell(m, output)
+
+    def cached_map(self, crossmodels, df, period, season, scenario=None):
+        """
+        Return the map of get_map, reusing the one built on an earlier rerun when nothing it depends on changed.
+
+        Maps are shared across sessions, keyed by dataset version, period,
+        season, scenario, the columns shown, the hash of the selected Crossmodel
+        IDs and the map view. Draw them with show_map.
+        """
+        key = (self.keyword, self.dataset.mtime, period, season, scenario, tuple(df.columns),
+               selection_hash(crossmodels), tuple(st.session_state.center), st.session_state.zoom, self.map_mode)
+        m = map_cache.get(key)
+        if m is None:
+            m = self.get_map(crossmodels, df, period, season)
+            self.add_hotspots(m, crossmodels)
+            m.render_lock = threading.Lock()
+            map_cache.put(key, m)
+        return m
+
+    def add_hotspots(self, m, crossmodels):
+        """
+        Circle the hotspot cells of the selection (see find_hotspots) on a map, with their rank and value as tooltip.
+
+        Every map of the analysis circles the same cells, the ones the prompt
+        lists: those of the selection's cached AnalysisResult, when compute
+        still holds it.
+        """
+        result = result_cache.get(self.result_key(crossmodels))
+        hot = result.tables['hotspots'] if result is not None else self.find_hotspots(crossmodels)
+        column = hot.columns[1]
+        cells = crossmodels[crossmodels['Crossmodel'].isin(hot['Crossmodel'])]
+        points = dict(zip(cells['Crossmodel'], cells.geometry.representative_point()))
+        group = folium.FeatureGroup(name='Hotspots')
+        for rank, (crossmodel, value) in enumerate(zip(hot['Crossmodel'], hot[column]), 1):
+            point = points[crossmodel]
+            folium.CircleMarker([point.y, point.x], radius=8, color='black', weight=2, fill=False,
+                                tooltip=f"#{rank} {crossmodel} {column}: {value:.2f}").add_to(group)
+        group.add_to(m)
+
+    def map_switching_layers(self, crossmodels, df, scenario=None, add_legend=True):
+        """
+        Draw every value column of `df` as one map of 'layers' map mode, on which the browser switches periods and seasons.
+
+        The map opens on the first column; picking another period or season
+        restyles it client-side, without a rerun.
+        """
+        first = self.cube.labels[df.columns[1]]
+        m = self.cached_map(crossmodels, df, first['period'], first['season'], scenario)
+        self.show_map(m, height=450, use_container_width=True, key=f"{self.keyword}_{scenario}_{df.columns[1]}_layers")
+        if add_legend:
+            self.add_legend()
+
     def map_comparing_period(self, crossmodels, df, season='spring', scenario='45', add_legend=True):
+        if self.map_mode == 'layers':
+            return self.map_switching_layers(crossmodels, df, scenario, add_legend)
         periods = self.data_info['periods']
-        captions = ["Historical", "Mid-century", "End-century"]
         cols = st.columns(len(periods))
         for i, period in enumerate(periods):
             with cols[i]:
-                m = self.get_map(crossmodels, df, period, season)
-                st.caption(captions[i])
-                st_folium(m, width=450, height=450, key=f"{self.keyword}_{season}_{period}_{scenario}")
+                m = self.cached_map(crossmodels, df, period, season, scenario)
+                st.caption(PERIOD_CAPTIONS[i])
+                self.show_map(m, width=450, height=450, key=f"{self.keyword}_{season}_{period}_{scenario}")
         if add_legend:
             self.add_legend()
 
     def map_comparing_period_by_choosing_season(self, crossmodels, df, scenario='45', add_legend=True):
+        if self.map_mode == 'layers':
+            # the seasons are switched on the map itself
+            return self.map_switching_layers(crossmodels, df, scenario, add_legend)
         custom_css = """
             <style>
             div[role="radiogroup"] label:nth-child(1) span {color: #4CAF50;}  /* spring */
@@ -74,71 +383,179 @@ class DataVisualizer(ABC):
         cols = st.columns(4, gap="small")
         for i, season in enumerate(seasons):
             with cols[i]:
-                m = self.get_map(crossmodels, df, period, season)
+                m = self.cached_map(crossmodels, df, period, season)
                 st.caption(season)
-                st_folium(m, width=350, height=450, key=f"{self.keyword}_{season}_{period}_2")
+                self.show_map(m, width=350, height=450, key=f"{self.keyword}_{season}_{period}_2")
         self.add_legend()
 
+    def result_key(self, crossmodels):
+        """Return the key of the AnalysisResult of a selection in result_cache."""
+        return (self.keyword, self.dataset.mtime, selection_hash(crossmodels))
+
+    def compute(self, crossmodels, statistics=None):
+        """
+        Compute the analysis of a selection of grid cells without touching Streamlit.
+
+        Results are shared across sessions, keyed by dataset version and the
+        hash of the selected Crossmodel IDs, and are safe to compute from
+        worker threads; each call gets its own prompt lists, since callers
+        append to them. `statistics` is the RunningStatistics to update, if
+        the caller keeps one across selections.
+        """
+        key = self.result_key(crossmodels)
+        result = result_cache.get(key)
+        if result is not None:
+            return result.with_own_messages()
+        df = self.select(crossmodels)
+        mean, std = self.calculate_statistics(df, statistics)
+        figures = self.create_figures(mean)
+        plots = plot_rendering.render_figures(figures) if self.plot_images else []
+        tables = self.create_tables(mean, std)
+        changes = self.calculate_changes(df)
+        if changes is not None:
+            tables['changes'] = changes
+        tables['hotspots'] = self.find_hotspots(df)
+        messages, code_messages = self.create_messages(tables)
+        result = AnalysisResult(self.keyword, df, mean, std, figures, plots, tables, messages, code_messages)
+        result_cache.put(key, result)
+        return result.with_own_messages()
+
     def analyze(self, crossmodels):
         st.title(self.data_info['title'])
         st.write(self.data_info['subtitle'])
-        df = convert_to_dataframe(self.df, self.values_of_interests, crossmodels)
+        result = self.compute(crossmodels, self.session_statistics())
+        crossmodels = self.join_selection(crossmodels, result.df)
         
         if self.data_info.get('season', False):
-            return self.analyze_seasonal(crossmodels, df)
+            return self.analyze_seasonal(crossmodels, result)
         else:
-            return self.analyze_annual(crossmodels, df)
+            return self.analyze_annual(crossmodels, result)
         
 
-    def analyze_seasonal(self, crossmodels, df):
-        climate_scenarios = False
-        if sum(df.columns.str.contains('45')) > 0 and sum(df.columns.str.contains('85')) > 0:
-            climate_scenarios = True
+    def analyze_seasonal(self, crossmodels, result):
+        df = result.df
+        climate_scenarios = {'45', '85'} <= set(self.cube.axes['scenario'])
 
         if climate_scenarios:
             st.header("Time Period Comparison")
-            columns_45 = [col for col in df.columns if '45' in col]
             st.header("RCP 4.5 Scenario")
-            self.map_comparing_period_by_choosing_season(crossmodels, df[['Crossmodel', 'hist'] + columns_45], scenario='45', add_legend=False)
+            self.map_comparing_period_by_choosing_season(crossmodels, df[['Crossmodel'] + self.cube.columns_where(scenario='45')], scenario='45', add_legend=False)
             st.header("RCP 8.5 Scenario")
-            self.map_comparing_period_by_choosing_season(crossmodels, df.drop(columns=columns_45), scenario='85')
+            self.map_comparing_period_by_choosing_season(crossmodels, df[['Crossmodel'] + self.cube.columns_where(scenario='85')], scenario='85')
 
         else:   
             st.header("Time Period & Seasonal Comparison")
             self.map_comparing_period_by_choosing_season(crossmodels, df)
-            self.map_comparing_season_by_choosing_period(crossmodels, df)
+            if self.map_mode != 'layers':
+                # a map of 'layers' mode already switches between every period and season
+                self.map_comparing_season_by_choosing_period(crossmodels, df)
         
         # remove 'projections' from the keyword
         title = self.keyword.replace(' projections', '')
         st.header(f"{title} Meta-Analysis")
-        mean, std = self.calculate_statistics(df)
-        figs = self.create_plots(mean)
-        return self.display_results(mean, std, figs)
+        return self.display_results(result)
 
-    def analyze_annual(self, crossmodels, df):
+    def analyze_annual(self, crossmodels, result):
+        df = result.df
         # check if there are two climate scenarios in the df.columns
-        climate_scenarios = False
-        if sum(df.columns.str.contains('45')) > 0 and sum(df.columns.str.contains('85')) > 0:
-            climate_scenarios = True
+        climate_scenarios = {'45', '85'} <= set(self.cube.axes['scenario'])
         
         st.header("Time Period Comparison")
 
         if climate_scenarios:
-            columns_45 = [col for col in df.columns if '45' in col]
             st.header("RCP 4.5 Scenario")
-            self.map_comparing_period(crossmodels, df[['Crossmodel', 'hist'] + columns_45], scenario='45', add_legend=False)
+            self.map_comparing_period(crossmodels, df[['Crossmodel'] + self.cube.columns_where(scenario='45')], scenario='45', add_legend=False)
             st.header("RCP 8.5 Scenario")
-            self.map_comparing_period(crossmodels, df.drop(columns=columns_45), scenario='85')
+            self.map_comparing_period(crossmodels, df[['Crossmodel'] + self.cube.columns_where(scenario='85')], scenario='85')
         else:
             self.map_comparing_period(crossmodels, df)
         st.header(f"{self.keyword} Meta-Analysis")
-        mean, std = self.calculate_statistics(df)
-        fig = self.create_plot(mean)
-        return self.display_results(mean, std, fig)
+        return self.display_results(result)
+
+    def session_statistics(self):
+        """
+        Return this session's RunningStatistics of the dataset.
+
+        They follow the session's selection incrementally, so redrawing a
+        region only reads the cells that changed.
+        """
+        key = (self.dataset.mtime, tuple(self.values_of_interests))
+        if 'climrr_statistics' not in st.session_state:
+            st.session_state.climrr_statistics = {}
+        version, statistics = st.session_state.climrr_statistics.get(self.keyword, (None, None))
+        if version != key:
+            statistics = RunningStatistics(self.values_of_interests)
+            st.session_state.climrr_statistics[self.keyword] = (key, statistics)
+        return statistics
+
+    def calculate_statistics(self, df, statistics=None):
+        """
+        Return the mean and standard deviation of each value column of the selection `df`.
+
+        Large selections are summed from the dataset's aggregate pyramid,
+        reading only the cells along their edges.
+        """
+        if statistics is None:
+            statistics = RunningStatistics(self.values_of_interests)
+        pyramid = self.dataset.pyramid() if len(df) >= PYRAMID_MIN_CELLS else None
+        statistics.update(self.df, df['Crossmodel'], pyramid)
+        mean, std = statistics.summary()
+        columns = df.columns.drop('Crossmodel')
+        return mean[columns], std[columns]
+
+    def calculate_changes(self, df):
+        """
+        Return the changes between periods and scenarios over the selection `df`, one row per compared pair.
 
-    def calculate_statistics(self, df):
-        df = df.drop(columns='Crossmodel')
-        return df.mean(), df.std()
+        The per-cell differences are read from the change columns written by
+        the data preparation step (see compute_changes) and averaged over the
+        selected cells. The percent change is that mean relative to the mean
+        magnitude of the baseline, so cells with a baseline near 0 do not
+        dominate it. None when the dataset was converted without them.
+        """
+        if not has_changes(self.data_info):
+            return None
+        changes = get_datasets([changes_info(self.data_info)])[0]
+        positions = changes.positions(df['Crossmodel'].to_numpy())
+        if (positions < 0).any():
+            raise KeyError('Crossmodel IDs missing from the change columns')
+        values = changes.df.take(positions)
+        rows = {}
+        for col, base in self.cube.changes():
+            delta = values[change_names(col, base)[0]]
+            baseline = df[base].abs().to_numpy()[delta.notna().to_numpy()].mean()
+            rows[f'{col} vs {base}'] = {'Mean change': delta.mean(), 'Std of change': delta.std(),
+                                        'Mean change (%)': 100 * delta.mean() / baseline if baseline else np.nan}
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def hotspot_metric(self, change=True, **labels):
+        """
+        Return the dataset and column of a metric for find_hotspots.
+
+        The metric is the value column of a period/season/scenario/variable
+        slot or, with `change` and when the dataset has change columns, its
+        change from the historical period. Labels left out default to the
+        last period, the last scenario, summer and the first variable.
+        """
+        axes = self.cube.axes
+        labels = dict({'period': axes['period'][-1], 'season': 'summer' if 'summer' in axes['season'] else axes['season'][0],
+                       'scenario': axes['scenario'][-1], 'variable': axes['variable'][0]}, **labels)
+        col = self.cube.slots[tuple(labels[axis] for axis in AXES)]
+        if change and has_changes(self.data_info):
+            base = self.cube.slots.get(tuple(dict(labels, period=axes['period'][0])[axis] for axis in AXES))
+            if base is not None and base != col:
+                return get_datasets([changes_info(self.data_info)])[0], change_names(col, base)[0]
+        return self.dataset, col
+
+    def find_hotspots(self, crossmodels, k=HOTSPOT_CELLS, largest=True, change=True, **labels):
+        """
+        Return the k selected cells with the largest (or smallest) value of a metric (see hotspot_metric), from the most extreme.
+
+        For instance, the 20 cells whose summer FWI increases most by the end
+        of the century: find_hotspots(crossmodels, 20, period='Endc', season='summer').
+        """
+        dataset, column = self.hotspot_metric(change, **labels)
+        return hotspots(dataset.df, column, crossmodels['Crossmodel'], k, largest, dataset.positions)
 
     @abstractmethod
     def get_map(self, crossmodels, df, period, season):
@@ -154,13 +571,40 @@ class DataVisualizer(ABC):
     def create_plot(self, mean):
         pass
 
+    def create_figures(self, mean):
+        """Return the meta-analysis figures as a list, from create_plots for seasonal datasets and create_plot otherwise."""
+        figs = self.create_plots(mean) if self.data_info.get('season', False) else self.create_plot(mean)
+        return figs if isinstance(figs, list) else [figs]
+
+    @abstractmethod
+    def create_tables(self, mean, std):
+        """Return the display tables by name; the 'prompt' table is the one the chat prompts are built from."""
+        pass
+
+    def create_messages(self, tables):
+        return self.get_messages(tables['prompt'], tables), None
+
     @abstractmethod
-    def display_results(self, mean, std, figs):
+    def display_results(self, result):
         pass
 
-    def get_messages(self, table):
+    def get_messages(self, table, tables=None):
+        """Return the chat prompt of the 'prompt' table, followed by the 'changes' and 'hotspots' tables when `tables` has them."""
         table = pd.DataFrame(table)
+        tables = tables or {}
         prompt = self.data_info['prompt'].format(table_markdown = table.to_markdown(), table_json = table.to_json())
+        changes = tables.get('changes')
+        if changes is not None:
+            prompt += ("\n\nChanges between time periods and scenarios, computed cell by cell and averaged over the area "
+                       "(the percent change is the mean change as a percentage of the area's mean absolute baseline value), "
+                       "in Markdown Table format:\n\n"
+                       f"{changes.round(2).to_markdown()}\n\nUse these changes when describing trends.")
+        hot = tables.get('hotspots')
+        if hot is not None and len(hot):
+            column = hot.columns[1]
+            metric = f"change {column.replace('_vs_', ' minus ')}" if '_vs_' in column else column
+            prompt += (f"\n\nThe {len(hot)} grid cells of the area with the largest {metric}, in Markdown Table format:"
+                       f"\n\n{hot.round(2).to_markdown(index=False)}\n\nMention where the values are most extreme when relevant.")
         messages = [{'role': 'system', 'content': "You are a helpful assistant that interprets climate data and relates it to specific user goals."},
                      {'role': 'user', 'content': prompt}]
         return messages
@@ -172,18 +616,6 @@ class DataVisualizer(ABC):
                      {'role': 'user', 'content': prompt}]
         return messages
 
-    def plots_to_base64(self):
-        plots = []
-        for plot in self.plots:
-            # Convert the plot to an image in memory.
-            image_bytes = pio.to_image(plot, format='png')
-
-            # Encode these bytes in base64
-            base64_bytes = base64.b64encode(image_bytes)
-            base64_string = base64_bytes.decode('utf8')
-            plots.append(base64_string)
-        self.plots = plots
-
 
 class ClimRRSeasonalProjectionsFWI(DataVisualizer):
     def __init__(self):
@@ -205,21 +637,27 @@ class ClimRRSeasonalProjectionsFWI(DataVisualizer):
         }
         return fwi_class_colors[categorize_fwi(value)]
 
+    def color_function_js(self):
+        """Return a JavaScript function mapping an FWI value to the color of its class."""
+        colors = [FWI_CLASS_COLORS[fwi_class] for fwi_class in FWI_CLASSES]
+        return f"""function(value) {{
+            var bins = {json.dumps(FWI_BINS)};
+            var colors = {json.dumps(colors)};
+            for (var i = 0; i < bins.length; i++) {{
+                if (value <= bins[i]) return colors[i];
+            }}
+            return colors[bins.length];
+        }}"""
+
+    def map_columns(self, values):
+        return {'class': categorize_fwi_array(values), 'color': fwi_colors(values)}
+
     def get_map(self, crossmodels, df, period, season='spring'):
-        season_columns = [col for col in df.columns if season in col and period in col]
-        season_fwi_df = df[['Crossmodel'] + season_columns]
+        season_columns = self.cube.columns_where(among=df.columns, period=period, season=season)
         col_name = season_columns[0]
-        season_fwi_df.loc[:, 'class'] = season_fwi_df[col_name].apply(categorize_fwi)
-
-        fwi_df_geo = gpd.GeoDataFrame(crossmodels.merge(season_fwi_df, left_on='Crossmodel', right_on='Crossmodel'))
+        fwi_df_geo = self.map_frame(crossmodels, df, col_name)
 
-        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
-        m.add_child(
-            folium.features.GeoJson(fwi_df_geo,
-                tooltip=folium.features.GeoJsonTooltip(fields=['Crossmodel', col_name, 'class'], aliases=['Crossmodel', 'FWI', 'class']),
-                style_function=lambda x: {'fillColor': fwi_color(x['properties'][col_name]),
-                                          'color': fwi_color(x['properties'][col_name])})
-        )
+        m = self.create_map(fwi_df_geo, col_name, ['Crossmodel', col_name, 'class'], ['Crossmodel', 'FWI', 'class'])
 
         # fwi_df_geo['color'] = fwi_df_geo[col_name].apply(self.fwi_color_plt)
         # fig, ax = plt.subplots(1, 1, figsize=(12, 8))
@@ -265,9 +703,7 @@ class ClimRRSeasonalProjectionsFWI(DataVisualizer):
         pass
 
     def create_plots(self, mean):
-        table = pd.DataFrame(mean.values.reshape(4, 3), 
-                             columns=self.data_info['periods'], 
-                             index=['spring', 'summer', 'autumn', 'winter'])
+        table = self.cube.table(mean, 'season', 'period')
         
         fig1 = px.line(table.T, title='Mean FWI Across Seasons and Time Periods', 
                        labels={'value': 'FWI', 'index': 'Time Period'},
@@ -282,68 +718,58 @@ class ClimRRSeasonalProjectionsFWI(DataVisualizer):
             fig.update_layout(legend_title_text='', legend=dict(traceorder='normal'),
                               plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
 
-        self.plots = [fig1, fig2]
-        self.plots_to_base64()
         return [fig1, fig2]
 
-    def display_results(self, mean, std, figs):
+    def create_tables(self, mean, std):
+        table = self.cube.table(mean, 'season', 'period')
+        std_table = self.cube.table(std, 'season', 'period')
+        
+        display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
+        data = {
+            'FWI Class': ['Low', 'Medium', 'High', 'Very High', 'Extreme', 'Very Extreme'],
+            'FWI Values': ['0-9', '9-21', '21-34', '34-39', '39-53', 'Above 53']
+        }
+        return {
+            'mean_std': display_table,
+            'classes': pd.DataFrame(data),
+            'prompt': (display_table + ' ' + table.map(categorize_fwi)).transpose(),
+        }
+
+    def create_messages(self, tables):
+        return self.get_messages(tables['prompt'], tables), self.get_coding_messages(tables['prompt'])
+
+    def display_results(self, result):
         col1, col2, col3 = st.columns([1, 1, 1])
         
         with col2:
-            for fig in figs:
+            for fig in result.figures:
                 st.plotly_chart(fig, use_container_width=True)
             st.write("These charts illustrate the trends in mean FWI values across seasons and time periods.")
 
         with col1:
-            table = pd.DataFrame(mean.values.reshape(4, 3), 
-                                 columns=self.data_info['periods'], 
-                                 index=['spring', 'summer', 'autumn', 'winter'])
-            std_table = pd.DataFrame(std.values.reshape(4, 3), 
-                                     columns=self.data_info['periods'], 
-                                     index=['spring', 'summer', 'autumn', 'winter'])
-            
-            display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
-            
             st.caption("Mean FWI Values (Std Dev)")
-            st.dataframe(display_table, use_container_width=True)
+            st.dataframe(result.tables['mean_std'], use_container_width=True)
             st.write("This table presents the mean FWI values for each season and time period, with standard deviations in parentheses.")
             
             st.caption("FWI Classification")
-            data = {
-                'FWI Class': ['Low', 'Medium', 'High', 'Very High', 'Extreme', 'Very Extreme'],
-                'FWI Values': ['0-9', '9-21', '21-34', '34-39', '39-53', 'Above 53']
-            }
-            st.dataframe(pd.DataFrame(data), hide_index=True, use_container_width=True)
+            st.dataframe(result.tables['classes'], hide_index=True, use_container_width=True)
             st.write("This table shows the classification of FWI values into risk categories.")    
-            display_table = display_table + ' ' + table.map(categorize_fwi)
 
-        messages = self.get_messages(display_table.transpose())
-        code_messages = self.get_coding_messages(display_table.transpose())
-        return col3, messages, code_messages, self.plots
+        return col3, result.messages, result.code_messages, result.plots
 
 
 class ClimRRAnnualClimateScenarios(DataVisualizer):
+    plot_images = False
+
     def __init__(self, keyword):
         super().__init__(keyword)
 
     def get_map(self, crossmodels, df, period, season = 'spring', label = 'Consecutive Days with No Precipitation'):
-        columns = [col for col in df.columns if period in col]
-        cdnp_df = df[['Crossmodel'] + columns]
+        columns = self.cube.columns_where(among=df.columns, period=period)
         col_name = columns[0]
+        cdnp_df_geo = self.map_frame(crossmodels, df, col_name)
 
-        cdnp_df_geo = gpd.GeoDataFrame(crossmodels.merge(cdnp_df, left_on='Crossmodel', right_on='Crossmodel'))
-
-        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
-        m.add_child(
-            folium.features.GeoJson(cdnp_df_geo, 
-                tooltip=folium.features.GeoJsonTooltip(fields=['Crossmodel', col_name], 
-                                                       aliases=['Crossmodel', label]),
-                style_function=lambda x: {'fillColor': self.get_color(x['properties'][col_name]), 
-                                          'color': 'black', 
-                                          'weight': 1, 
-                                          'fillOpacity': 0.7})
-        )
-        return m
+        return self.create_map(cdnp_df_geo, col_name, ['Crossmodel', col_name], ['Crossmodel', label], outline=ANNUAL_OUTLINE)
 
     def add_legend(self, lable='Consecutive Days with No Precipitation'):
         fig, ax = plt.subplots(figsize=(6, 1))
@@ -429,40 +855,37 @@ class ClimRRAnnualClimateScenarios(DataVisualizer):
 
         return fig
     
-    def display_results(self, mean, std, fig, label, label_with_metric, metric):
+    def create_tables(self, mean, std):
+        table = pd.DataFrame(mean).T
+        table.index = ['Annual']
+        std_table = pd.DataFrame(std).T
+        std_table.index = ['Annual']
+
+        # Separate tables for RCP 4.5 and RCP 8.5, both starting from the historical data
+        columns_45 = self.cube.columns_where(scenario='45')
+        columns_85 = self.cube.columns_where(scenario='85')
+        table_45, std_table_45 = table[columns_45], std_table[columns_45]
+        table_85, std_table_85 = table[columns_85], std_table[columns_85]
+
+        # Format the display tables
+        display_table_45 = table_45.map(lambda x: f"{x:.2f}") + ' (' + std_table_45.map(lambda x: f"{x:.2f}") + ')'
+        display_table_85 = table_85.map(lambda x: f"{x:.2f}") + ' (' + std_table_85.map(lambda x: f"{x:.2f}") + ')'
+        return {'rcp45': display_table_45, 'rcp85': display_table_85, 'prompt': table}
+
+    def display_results(self, result, label, label_with_metric, metric):
         col1, col2, col3 = st.columns([1, 1, 1])
         
         with col2:
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(result.figures[0], use_container_width=True)
             st.write(f"This chart illustrates the trends in {label} across the three time periods.")
 
         with col1:
-            table = pd.DataFrame(mean).T
-            table.index = ['Annual']
-            std_table = pd.DataFrame(std).T
-            std_table.index = ['Annual']
-
-            # Separate the historical data
-            table_hist = table.loc[:, table.columns.str.contains('hist')]
-            std_table_hist = std_table.loc[:, std_table.columns.str.contains('hist')]
-
-            # Create separate tables for RCP 4.5 and RCP 8.5
-            table_45 = pd.concat([table_hist, table.loc[:, table.columns.str.contains('45')]], axis=1)
-            table_85 = pd.concat([table_hist, table.loc[:, table.columns.str.contains('85')]], axis=1)
-
-            std_table_45 = pd.concat([std_table_hist, std_table.loc[:, std_table.columns.str.contains('45')]], axis=1)
-            std_table_85 = pd.concat([std_table_hist, std_table.loc[:, std_table.columns.str.contains('85')]], axis=1)
-
-            # Format the display tables
-            display_table_45 = table_45.map(lambda x: f"{x:.2f}") + ' (' + std_table_45.map(lambda x: f"{x:.2f}") + ')'
-            display_table_85 = table_85.map(lambda x: f"{x:.2f}") + ' (' + std_table_85.map(lambda x: f"{x:.2f}") + ')'
-
             # Display the tables using Streamlit
             st.caption(f"{label_with_metric} (Std Dev) - RCP 4.5")
-            st.dataframe(display_table_45, use_container_width=True)
+            st.dataframe(result.tables['rcp45'], use_container_width=True)
 
             st.caption(f"{label_with_metric} (Std Dev) - RCP 8.5")
-            st.dataframe(display_table_85, use_container_width=True)
+            st.dataframe(result.tables['rcp85'], use_container_width=True)
 
             st.write(f"These tables present the {label} values for each time period and scenario, with standard deviations in parentheses.")
 
@@ -471,9 +894,7 @@ class ClimRRAnnualClimateScenarios(DataVisualizer):
             st.write(f"Maximum: {self.max_value:.2f} {metric}")
             st.write(f"This shows the range of {label} values in the dataset.")
 
-        messages = self.get_messages(table)
-
-        return col3, messages, self.plots
+        return col3, result.messages, result.plots
     
     
 class ClimRRAnnualProjectionsPrecipitation(ClimRRAnnualClimateScenarios):
@@ -492,8 +913,8 @@ class ClimRRAnnualProjectionsPrecipitation(ClimRRAnnualClimateScenarios):
     def create_plot(self, mean, col_label='Precipitation', label_with_metric='Precipitation (mm)', title='Total Annual Precipitation'):
         return super().create_plot(mean, col_label, label_with_metric, title)
 
-    def display_results(self, mean, std, fig):
-        return super().display_results(mean, std, fig, 'total annual precipitation', 'Total Annual Precipitation (mm)', 'mm')
+    def display_results(self, result):
+        return super().display_results(result, 'total annual precipitation', 'Total Annual Precipitation (mm)', 'mm')
 
 class ClimRRAnnualProjectionsTemperature(ClimRRAnnualClimateScenarios):
     def __init__(self, temp_type):
@@ -512,8 +933,8 @@ class ClimRRAnnualProjectionsTemperature(ClimRRAnnualClimateScenarios):
     def create_plot(self, mean):
         return super().create_plot(mean, f'{self.temp_type} Temperature', f'{self.temp_type} Temperature (°F)', f'Mean {self.temp_type} Temperature')
     
-    def display_results(self, mean, std, fig):
-        return super().display_results(mean, std, fig, f'mean {self.temp_type} temperature', f'Mean {self.temp_type} Temperature (°F)', '°F')
+    def display_results(self, result):
+        return super().display_results(result, f'mean {self.temp_type} temperature', f'Mean {self.temp_type} Temperature (°F)', '°F')
         
 class ClimRRAnnualProjectionsCDNP(ClimRRAnnualClimateScenarios):
     def __init__(self):
@@ -531,8 +952,8 @@ class ClimRRAnnualProjectionsCDNP(ClimRRAnnualClimateScenarios):
     def create_plot(self, mean):
         return super().create_plot(mean, 'Consecutive Days with No Precipitation', 'Consecutive Days with No Precipitation', 'Consecutive Days with No Precipitation')
 
-    def display_results(self, mean, std, fig):
-        return super().display_results(mean, std, fig, 'consecutive dry days', 'Consecutive Dry Days', 'days')
+    def display_results(self, result):
+        return super().display_results(result, 'consecutive dry days', 'Consecutive Dry Days', 'days')
 
 
 class ClimRRAnnualProjectionsWindSpeed(ClimRRAnnualClimateScenarios):
@@ -543,23 +964,7 @@ class ClimRRAnnualProjectionsWindSpeed(ClimRRAnnualClimateScenarios):
         return plt.cm.get_cmap('YlGnBu')
 
     def get_map(self, crossmodels, df, period, season='spring'):
-        columns = [col for col in df.columns if period in col]
-        windspeed_df = df[['Crossmodel'] + columns]
-        col_name = columns[0]
-
-        windspeed_df_geo = gpd.GeoDataFrame(crossmodels.merge(windspeed_df, left_on='Crossmodel', right_on='Crossmodel'))
-
-        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
-        m.add_child(
-            folium.features.GeoJson(windspeed_df_geo, 
-                tooltip=folium.features.GeoJsonTooltip(fields=['Crossmodel', col_name], 
-                                                       aliases=['Crossmodel', 'Wind Speed (m/s)']),
-                style_function=lambda x: {'fillColor': self.get_color(x['properties'][col_name]), 
-                                          'color': 'black', 
-                                          'weight': 1, 
-                                          'fillOpacity': 0.7})
-        )
-        return m
+        return super().get_map(crossmodels, df, period, label='Wind Speed (m/s)')
 
     def add_legend(self):
         fig, ax = plt.subplots(figsize=(6, 1))
@@ -585,8 +990,8 @@ class ClimRRAnnualProjectionsWindSpeed(ClimRRAnnualClimateScenarios):
     def create_plot(self, mean):
         return super().create_plot(mean, 'Wind Speed', 'Wind Speed (m/s)', 'Mean Annual Wind Speed')
 
-    def display_results(self, mean, std, fig):
-        return super().display_results(mean, std, fig, 'mean annual wind speed', 'Mean Annual Wind Speed (m/s)', 'm/s')
+    def display_results(self, result):
+        return super().display_results(result, 'mean annual wind speed', 'Mean Annual Wind Speed (m/s)', 'm/s')
 
 
 class ClimRRAnnualProjectionsCoolingDegreeDays(DataVisualizer):
@@ -598,23 +1003,11 @@ class ClimRRAnnualProjectionsCoolingDegreeDays(DataVisualizer):
 
     def get_map(self, crossmodels, df, period, season='spring'):
         # For CDD, we don't use seasons, so we ignore the season parameter
-        columns = [col for col in df.columns if period in col]
-        cdd_df = df[['Crossmodel'] + columns]
+        columns = self.cube.columns_where(among=df.columns, period=period)
         col_name = columns[0]
+        cdd_df_geo = self.map_frame(crossmodels, df, col_name)
 
-        cdd_df_geo = gpd.GeoDataFrame(crossmodels.merge(cdd_df, left_on='Crossmodel', right_on='Crossmodel'))
-
-        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
-        m.add_child(
-            folium.features.GeoJson(cdd_df_geo, 
-                tooltip=folium.features.GeoJsonTooltip(fields=['Crossmodel', col_name], 
-                                                    aliases=['Crossmodel', 'Cooling Degree Days']),
-                style_function=lambda x: {'fillColor': self.get_color(x['properties'][col_name]), 
-                                        'color': 'black', 
-                                        'weight': 1, 
-                                        'fillOpacity': 0.7})
-        )
-        return m
+        return self.create_map(cdd_df_geo, col_name, ['Crossmodel', col_name], ['Crossmodel', 'Cooling Degree Days'], outline=ANNUAL_OUTLINE)
 
     def add_legend(self):
         fig, ax = plt.subplots(figsize=(6, 1))
@@ -646,27 +1039,27 @@ class ClimRRAnnualProjectionsCoolingDegreeDays(DataVisualizer):
                      color_discrete_sequence=['#FFA500', '#FF4500'])  # Orange for historical, Red-Orange for future
 
         fig.update_layout(showlegend=False, plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
-        self.plots = [fig]
-        self.plots_to_base64()
         return fig
 
-    def display_results(self, mean, std, fig):
+    def create_tables(self, mean, std):
+        table = pd.DataFrame(mean).T
+        table.index = ['Annual']
+        std_table = pd.DataFrame(std).T
+        std_table.index = ['Annual']
+        
+        display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
+        return {'mean_std': display_table, 'prompt': table}
+
+    def display_results(self, result):
         col1, col2, col3 = st.columns([1, 1, 1])
         
         with col2:
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(result.figures[0], use_container_width=True)
             st.write("This chart compares Cooling Degree Days between historical data and mid-century projections.")
 
         with col1:
-            table = pd.DataFrame(mean).T
-            table.index = ['Annual']
-            std_table = pd.DataFrame(std).T
-            std_table.index = ['Annual']
-            
-            display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
-            
             st.caption("Mean Annual Cooling Degree Days (Std Dev)")
-            st.dataframe(display_table, use_container_width=True)
+            st.dataframe(result.tables['mean_std'], use_container_width=True)
             st.write("This table presents the mean annual Cooling Degree Days for historical and mid-century periods, with standard deviations in parentheses.")
 
             st.caption("Cooling Degree Days Range")
@@ -674,25 +1067,20 @@ class ClimRRAnnualProjectionsCoolingDegreeDays(DataVisualizer):
             st.write(f"Maximum: {self.max_value:.2f}")
             st.write("This shows the range of Cooling Degree Days in the dataset.")
         
-        messages = self.get_messages(table)
-        return col3, messages, self.plots
+        return col3, result.messages, result.plots
 
     def analyze(self, crossmodels):
         st.title(self.data_info['title'])
         st.write(self.data_info['subtitle'])
-        df = convert_to_dataframe(self.df, self.values_of_interests, crossmodels)
+        result = self.compute(crossmodels, self.session_statistics())
+        df = result.df
+        crossmodels = self.join_selection(crossmodels, df)
         
         st.header("Time Period Comparison")
         self.map_comparing_period(crossmodels, df)
         
         st.header("Cooling Degree Days Meta-Analysis")
-        mean, std = self.calculate_statistics(df)
-        fig = self.create_plot(mean)
-        return self.display_results(mean, std, fig)
-
-    def calculate_statistics(self, df):
-        df = df.drop(columns='Crossmodel')
-        return df.mean(), df.std()
+        return self.display_results(result)
 
 
 class ClimRRAnnualProjectionsHeatingDegreeDays(DataVisualizer):
@@ -704,23 +1092,11 @@ class ClimRRAnnualProjectionsHeatingDegreeDays(DataVisualizer):
 
     def get_map(self, crossmodels, df, period, season='spring'):
         # For HDD, we don't use seasons, so we ignore the season parameter
-        columns = [col for col in df.columns if period in col]
-        hdd_df = df[['Crossmodel'] + columns]
+        columns = self.cube.columns_where(among=df.columns, period=period)
         col_name = columns[0]
+        hdd_df_geo = self.map_frame(crossmodels, df, col_name)
 
-        hdd_df_geo = gpd.GeoDataFrame(crossmodels.merge(hdd_df, left_on='Crossmodel', right_on='Crossmodel'))
-
-        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
-        m.add_child(
-            folium.features.GeoJson(hdd_df_geo, 
-                tooltip=folium.features.GeoJsonTooltip(fields=['Crossmodel', col_name], 
-                                                    aliases=['Crossmodel', 'Heating Degree Days']),
-                style_function=lambda x: {'fillColor': self.get_color(x['properties'][col_name]), 
-                                        'color': 'black', 
-                                        'weight': 1, 
-                                        'fillOpacity': 0.7})
-        )
-        return m
+        return self.create_map(hdd_df_geo, col_name, ['Crossmodel', col_name], ['Crossmodel', 'Heating Degree Days'], outline=ANNUAL_OUTLINE)
 
     def add_legend(self):
         fig, ax = plt.subplots(figsize=(6, 1))
@@ -752,27 +1128,27 @@ class ClimRRAnnualProjectionsHeatingDegreeDays(DataVisualizer):
                         color_discrete_sequence=['#4682B4', '#4682B4'])
 
         fig.update_layout(showlegend=False, plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
-        self.plots = [fig]
-        self.plots_to_base64()
         return fig
 
-    def display_results(self, mean, std, fig):
+    def create_tables(self, mean, std):
+        table = pd.DataFrame(mean).T
+        table.index = ['Annual']
+        std_table = pd.DataFrame(std).T
+        std_table.index = ['Annual']
+        
+        display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
+        return {'mean_std': display_table, 'prompt': table}
+
+    def display_results(self, result):
         col1, col2, col3 = st.columns([1, 1, 1])
         
         with col2:
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(result.figures[0], use_container_width=True)
             st.write("This chart illustrates the trend in Heating Degree Days across the time periods.")
 
         with col1:
-            table = pd.DataFrame(mean).T
-            table.index = ['Annual']
-            std_table = pd.DataFrame(std).T
-            std_table.index = ['Annual']
-            
-            display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
-            
             st.caption("Mean Annual Heating Degree Days (Std Dev)")
-            st.dataframe(display_table, use_container_width=True)
+            st.dataframe(result.tables['mean_std'], use_container_width=True)
             st.write("This table presents the mean annual Heating Degree Days for each time period, with standard deviations in parentheses.")
 
             st.caption("Heating Degree Days Range")
@@ -780,25 +1156,20 @@ class ClimRRAnnualProjectionsHeatingDegreeDays(DataVisualizer):
             st.write(f"Maximum: {self.max_value:.2f}")
             st.write("This shows the range of Heating Degree Days in the dataset.")
 
-        messages = self.get_messages(table)
-        return col3, messages, self.plots
+        return col3, result.messages, result.plots
 
     def analyze(self, crossmodels):
         st.title(self.data_info['title'])
         st.write(self.data_info['subtitle'])
-        df = convert_to_dataframe(self.df, self.values_of_interests, crossmodels)
+        result = self.compute(crossmodels, self.session_statistics())
+        df = result.df
+        crossmodels = self.join_selection(crossmodels, df)
         
         st.header("Time Period Comparison")
         self.map_comparing_period(crossmodels, df)
         
         st.header("Heating Degree Days Meta-Analysis")
-        mean, std = self.calculate_statistics(df)
-        fig = self.create_plot(mean)
-        return self.display_results(mean, std, fig)
-
-    def calculate_statistics(self, df):
-        df = df.drop(columns='Crossmodel')
-        return df.mean(), df.std()
+        return self.display_results(result)
 
 
 class ClimRRSeasonalProjections(DataVisualizer):
@@ -811,21 +1182,11 @@ class ClimRRSeasonalProjections(DataVisualizer):
         pass
 
     def get_map(self, crossmodels, df, period, season='spring', label=None):
-        season_columns = [col for col in df.columns if season in col and period in col]
-        season_temp_df = df[['Crossmodel'] + season_columns]
+        season_columns = self.cube.columns_where(among=df.columns, period=period, season=season)
         col_name = season_columns[0]
+        temp_df_geo = self.map_frame(crossmodels, df, col_name)
 
-        temp_df_geo = gpd.GeoDataFrame(crossmodels.merge(season_temp_df, left_on='Crossmodel', right_on='Crossmodel'))
-
-        m = folium.Map(location=st.session_state.center, zoom_start=st.session_state.zoom)
-        m.add_child(
-            folium.features.GeoJson(temp_df_geo, 
-                tooltip=folium.features.GeoJsonTooltip(fields=['Crossmodel', col_name], 
-                                                    aliases=['Crossmodel', label]),
-                style_function=lambda x: {'fillColor': self.get_color(x['properties'][col_name]), 
-                                        'color': self.get_color(x['properties'][col_name])})
-        )
-        return m
+        return self.create_map(temp_df_geo, col_name, ['Crossmodel', col_name], ['Crossmodel', label])
     
     def add_legend(self, label):
         fig, ax = plt.subplots(figsize=(6, 1))
@@ -849,9 +1210,7 @@ class ClimRRSeasonalProjections(DataVisualizer):
         st.markdown(legend_html, unsafe_allow_html=True)
 
     def create_plots(self, mean, title, label):
-        table = pd.DataFrame(mean.values.reshape(4, 3), 
-                             columns=self.data_info['periods'], 
-                             index=self.seasons)
+        table = self.cube.table(mean, 'season', 'period')
         
         fig1 = px.line(table.T, title=f'{title} Across Seasons and Time Periods', 
                        labels={'value': label, 'index': 'Time Period'},
@@ -866,30 +1225,26 @@ class ClimRRSeasonalProjections(DataVisualizer):
             fig.update_layout(legend_title_text='', legend=dict(traceorder='normal'),
                               plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
 
-        self.plots = [fig1, fig2]
-        self.plots_to_base64()
         return [fig1, fig2]
         
-    def display_results(self, mean, std, figs, title, label, metric):
+    def create_tables(self, mean, std):
+        table = self.cube.table(mean, 'season', 'period')
+        std_table = self.cube.table(std, 'season', 'period')
+        
+        display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
+        return {'mean_std': display_table, 'prompt': display_table.transpose()}
+
+    def display_results(self, result, title, label, metric):
         col1, col2, col3 = st.columns([1, 1, 1])
         
         with col2:
-            for fig in figs:
+            for fig in result.figures:
                 st.plotly_chart(fig, use_container_width=True)
             st.write(f"These charts illustrate the trends in {title} values across seasons and time periods.")
 
         with col1:
-            table = pd.DataFrame(mean.values.reshape(4, 3), 
-                                 columns=self.data_info['periods'], 
-                                 index=self.seasons)
-            std_table = pd.DataFrame(std.values.reshape(4, 3), 
-                                     columns=self.data_info['periods'], 
-                                     index=self.seasons)
-            
-            display_table = table.map(lambda x: f"{x:.2f}") + ' (' + std_table.map(lambda x: f"{x:.2f}") + ')'
-            
             st.caption(f"{title} Values (Std Dev)")
-            st.dataframe(display_table, use_container_width=True)
+            st.dataframe(result.tables['mean_std'], use_container_width=True)
             st.write(f"This table presents the mean {title} values for each season and time period, with standard deviations in parentheses.")
             
             st.caption(f"{label} Range")
@@ -897,30 +1252,35 @@ class ClimRRSeasonalProjections(DataVisualizer):
             st.write(f"Maximum: {self.max_value:.2f} {metric}")
             st.write(f"This shows the range of {label} values in the dataset.")
 
-        messages = self.get_messages(display_table.transpose())
-        return col3, messages, self.plots
+        return col3, result.messages, result.plots
     
 
-    def calculate_statistics(self, df):
-        df = df.drop(columns='Crossmodel')
-        return df.mean(), df.std()
-    
     def analyze(self, crossmodels, label):
         st.title(self.data_info['title'])
         st.write(self.data_info['subtitle'])
-        df = convert_to_dataframe(self.df, self.values_of_interests, crossmodels)
+        result = self.compute(crossmodels, self.session_statistics())
+        df = result.df
+        crossmodels = self.join_selection(crossmodels, df)
 
         st.header("Time Period & Seasonal Comparison")
-        st.write(f"""
-            This section allows you to compare {label} values for a specific season across three time periods:
-            historical, mid-century, and end-century.
-            Use the radio buttons below to select a season and observe how {label} is projected to change over time.
-        """)
-        self.map_comparing_period_by_choosing_season(crossmodels, df, add_legend=False)
-        st.write(f"""
-            Use the radio buttons to select a time period and observe how {label} varies by season.
+        if self.map_mode == 'layers':
+            st.write(f"""
+                This section allows you to compare {label} values across seasons and three time periods:
+                historical, mid-century, and end-century.
+                Use the buttons on the map to select a season and a time period.
             """)
-        self.map_comparing_season_by_choosing_period(crossmodels, df)
+            self.map_switching_layers(crossmodels, df)
+        else:
+            st.write(f"""
+                This section allows you to compare {label} values for a specific season across three time periods:
+                historical, mid-century, and end-century.
+                Use the radio buttons below to select a season and observe how {label} is projected to change over time.
+            """)
+            self.map_comparing_period_by_choosing_season(crossmodels, df, add_legend=False)
+            st.write(f"""
+                Use the radio buttons to select a time period and observe how {label} varies by season.
+                """)
+            self.map_comparing_season_by_choosing_period(crossmodels, df)
         
         st.header(f"{label} Meta-Analysis")
         st.write(f"""
@@ -928,9 +1288,7 @@ class ClimRRSeasonalProjections(DataVisualizer):
             It includes line charts showing trends over time and tables with detailed numerical data.
         """)
 
-        mean, std = self.calculate_statistics(df)
-        figs = self.create_plots(mean)
-        return self.display_results(mean, std, figs)
+        return self.display_results(result)
 
 
 
@@ -951,8 +1309,8 @@ class ClimRRSeasonalProjectionsTemperature(ClimRRSeasonalProjections):
     def create_plots(self, mean):
         return super().create_plots(mean, f'Mean {self.temp_type} Temperature', f'Temperature (°F)')
 
-    def display_results(self, mean, std, figs):
-        return super().display_results(mean, std, figs, f'Mean {self.temp_type} Temperature', f'{self.temp_type} Temperature', '°F')
+    def display_results(self, result):
+        return super().display_results(result, f'Mean {self.temp_type} Temperature', f'{self.temp_type} Temperature', '°F')
 
     def analyze(self, crossmodels):
         return super().analyze(crossmodels, f'{self.temp_type} Temperature')
@@ -974,8 +1332,8 @@ class ClimRRDailyProjectionsPrecipitation(ClimRRSeasonalProjections):
     def create_plots(self, mean):
         return super().create_plots(mean, f'Average {self.agg_type} Daily Precipitation', f'Daily Precipitation (mm)')
 
-    def display_results(self, mean, std, figs):
-        return super().display_results(mean, std, figs, f'Average {self.agg_type} Daily Precipitation', f'{self.agg_type} Daily Precipitation', 'mm')
+    def display_results(self, result):
+        return super().display_results(result, f'Average {self.agg_type} Daily Precipitation', f'{self.agg_type} Daily Precipitation', 'mm')
 
     def analyze(self, crossmodels):
         return super().analyze(crossmodels, f'{self.agg_type} Daily Precipitation')
@@ -988,20 +1346,20 @@ class ClimRRAnnualProjectionsHeatIndex(ClimRRAnnualClimateScenarios):
     def create_color_scale(self):
         return plt.cm.get_cmap('RdYlBu_r')  # Red (hot) to Blue (cold) color scale
     
-    def analyze_annual(self, crossmodels, df):
-        # check if there are two climate scenarios in the df.columns
+    def analyze_annual(self, crossmodels, result):
+        df = result.df
         
         st.header("Time Period Comparison")
 
-        columns_daily = [col for col in df.columns if 'DayMax' in col]
+        columns_daily = self.cube.columns_where(variable='DayMax')
         st.header("Summer Daily Max Heat Index")
         self.map_comparing_period(crossmodels, df[['Crossmodel'] + columns_daily], scenario='daily', add_legend=False)
         st.header("Summer Seasonal Max Heat Index")
-        columns_seasonal = [col for col in df.columns if 'SeaMax' in col]
+        columns_seasonal = self.cube.columns_where(variable='SeaMax')
         self.map_comparing_period(crossmodels, df[['Crossmodel'] + columns_seasonal], scenario='seasonal')
         st.header("# of Summer Days Above Threshold")
         threshold = st.radio("Select a threshold (in °F) for the number of summer days above", ['95', '105', '115', '125'], horizontal=True)
-        columns_daily = [col for col in df.columns if f'Day{threshold}' in col]
+        columns_daily = self.cube.columns_where(variable=f'Day{threshold}')
         self.map_comparing_period(crossmodels, df[['Crossmodel'] + columns_daily], scenario='daily', add_legend=False)
         
         fig, ax = plt.subplots(figsize=(6, 1))
@@ -1027,14 +1385,13 @@ class ClimRRAnnualProjectionsHeatIndex(ClimRRAnnualClimateScenarios):
 
 
         st.header(f"{self.keyword} Meta-Analysis")
-        mean, std = self.calculate_statistics(df)
-        fig = self.create_plot(mean)
-        return self.display_results(mean, std, fig)
+        return self.display_results(result)
 
     def get_map(self, crossmodels, df, period, season='spring'):
-        if 'DayMax' in df.columns:
+        variables = self.cube.labels_of(df.columns, 'variable')
+        if 'DayMax' in variables:
             return super().get_map(crossmodels, df, period, season, label='Summer Daily Max Heat Index')
-        elif 'SeaMax' in df.columns:
+        elif 'SeaMax' in variables:
             return super().get_map(crossmodels, df, period, season, label='Summer Seasonal Max Heat Index')
         else:
             return super().get_map(crossmodels, df, period, season, label='# of Summer Days Above Threshold')
@@ -1135,11 +1492,12 @@ class ClimRRAnnualProjectionsHeatIndex(ClimRRAnnualClimateScenarios):
 
         return [fig, fig2]
     
-    def display_results_helper(self, table, std_table, scenarios, indices):
+    def display_results_helper(self, table, std_table, variables, indices):
         display_tables = []
-        for scenario in scenarios:
-            table_scenario = table.loc[:, table.columns.str.contains(scenario)]
-            std_table_scenario = std_table.loc[:, std_table.columns.str.contains(scenario)]
+        for variable in variables:
+            columns = self.cube.columns_where(variable=variable)
+            table_scenario = table[columns]
+            std_table_scenario = std_table[columns]
             display_table_scenario = table_scenario.map(lambda x: f"{x:.2f}") + ' (' + std_table_scenario.map(lambda x: f"{x:.2f}") + ')'
             display_table_scenario.columns = ['Historical', 'Mid-Century', 'End-Century']
             display_tables.append(display_table_scenario)
@@ -1149,23 +1507,27 @@ class ClimRRAnnualProjectionsHeatIndex(ClimRRAnnualClimateScenarios):
         return final_display_table
 
     
-    def display_results(self, mean, std, figs, label = 'Heat Index', label_with_metric = 'Heat Index', metric = ''):
+    def create_tables(self, mean, std):
+        table = pd.DataFrame(mean).T
+        std_table = pd.DataFrame(std).T
+        return {
+            'heat_index': self.display_results_helper(table, std_table, ['DayMax', 'SeaMax'], ['Daily Max', 'Seasonal Max']),
+            'days_above': self.display_results_helper(table, std_table, ['Day95', 'Day105', 'Day115', 'Day125'], ['95 F', '105 F', '115 F', '125 F']),
+            'prompt': table,
+        }
+
+    def display_results(self, result, label = 'Heat Index', label_with_metric = 'Heat Index', metric = ''):
         col1, col2, col3 = st.columns([1, 1, 1])
         
         with col2:
-            for fig in figs:
+            for fig in result.figures:
                 st.plotly_chart(fig, use_container_width=True)
             st.write(f"This chart illustrates the trends in {label} across the three time periods.")
 
         with col1:
-            table = pd.DataFrame(mean).T
-            std_table = pd.DataFrame(std).T
-
-            display_table_heat_index = self.display_results_helper(table, std_table, ['DayMax', 'SeaMax'], ['Daily Max', 'Seasonal Max'])
-
             # Display the tables using Streamlit
             st.caption(f"{label_with_metric} (Std Dev) - Summer Max Heat Index")
-            st.dataframe(display_table_heat_index, use_container_width=True)
+            st.dataframe(result.tables['heat_index'], use_container_width=True)
 
             st.write(f"These tables present the {label} values for each time period and scenario, with standard deviations in parentheses.")
 
@@ -1174,10 +1536,7 @@ class ClimRRAnnualProjectionsHeatIndex(ClimRRAnnualClimateScenarios):
             st.write(f"Maximum: {self.max_value:.2f} {metric}")
             st.write(f"This shows the range of {label} values in the dataset.")
 
-            display_table_days_above = self.display_results_helper(table, std_table, ['Day95', 'Day105', 'Day115', 'Day125'], ['95 F', '105 F', '115 F', '125 F'])
             st.caption(f"Number of Summer Days Above Threshold")
-            st.dataframe(display_table_days_above, use_container_width=True)
+            st.dataframe(result.tables['days_above'], use_container_width=True)
 
-            
-        messages = self.get_messages(table)
-        return col3, messages, self.plots
+        return col3, result.messages, result.plots
@@ -0,0 +1,215 @@
+import os
+import threading
+import pandas as pd
+from collections import OrderedDict
+from src.data_vis.climrr_store import load_climrr_table, load_stats, source_path, is_combined, load_combined_tables, is_memory_mapped, load_value_tables
+from src.data_vis.climrr_utils import index_by_crossmodel, sorted_positions
+from src.data_vis.climrr_cube import ClimRRCube
+
+# Upper bound on the memory held by the process-wide dataset registry.
+MAX_CACHE_BYTES = int(os.environ.get('CLIMRR_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Number of rendered folium maps kept by the map artifact cache.
+MAX_CACHED_MAPS = int(os.environ.get('CLIMRR_MAP_CACHE_ENTRIES', 128))
+# Number of analysis results kept by the result cache.
+MAX_CACHED_RESULTS = int(os.environ.get('CLIMRR_RESULT_CACHE_ENTRIES', 64))
+
+
+class BoundedCache:
+    """
+    A thread-safe LRU cache bounded by total size and/or number of entries.
+
+    `sizeof` returns the size of a value in bytes; it is only needed when
+    `max_bytes` is set. The most recently inserted entry is never evicted,
+    so a single value larger than the cap is still served.
+    """
+    def __init__(self, max_bytes=None, max_entries=None, sizeof=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof or (lambda value: 0)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.pop(key)
+            size = self.sizeof(value)
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            self.evict()
+
+    def pop(self, key):
+        with self.lock:
+            value, size = self.entries.pop(key)
+            self.total_bytes -= size
+            return value
+
+    def evict(self):
+        while len(self.entries) > 1 and self.is_full():
+            oldest = next(iter(self.entries))
+            self.pop(oldest)
+
+    def is_full(self):
+        if self.max_entries is not None and len(self.entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+class ClimRRDataset:
+    """
+    A loaded ClimRR table together with the state derived from it.
+
+    The table is indexed by Crossmodel so that selections are gathered with a
+    single index lookup instead of one scan per grid cell. The value range
+    comes from the statistics sidecar when the data preparation step wrote
+    one, and is computed from the table otherwise. `df` is the table when it
+    was already loaded, indexed by Crossmodel (see get_datasets), and `keys`
+    the sorted array of its Crossmodel IDs when its rows are in that order.
+    """
+    def __init__(self, path, values_of_interests, df=None, keys=None):
+        self.path = path
+        self.values_of_interests = values_of_interests
+        self.df = df if df is not None else index_by_crossmodel(load_climrr_table(path, values_of_interests))
+        self.keys = keys
+        self.stats = load_stats(path, values_of_interests)
+        if self.stats is not None:
+            columns = self.stats['columns']
+            self.min_value = pd.Series([columns[col]['min'] for col in values_of_interests]).min()
+            self.max_value = pd.Series([columns[col]['max'] for col in values_of_interests]).max()
+        else:
+            self.min_value = self.df[values_of_interests].min().min()
+            self.max_value = self.df[values_of_interests].max().max()
+        # the index of memory-mapped tables is shared by every dataset of the store, so it is not walked string by string
+        self.nbytes = int(self.df.memory_usage(deep=keys is None).sum())
+        self.cubes = {}
+        self.aggregates = None
+
+    def positions(self, crossmodels):
+        """Return the row of each Crossmodel ID in the table, -1 for missing IDs, by binary search when the keys are sorted."""
+        if self.keys is not None:
+            return sorted_positions(self.keys, crossmodels)
+        return self.df.index.get_indexer(crossmodels)
+
+    def cube(self, periods):
+        """Return the ClimRRCube of the table for the periods of climrr.yml, parsing the columns once."""
+        key = tuple(periods)
+        if key not in self.cubes:
+            self.cubes[key] = ClimRRCube(self.values_of_interests, periods)
+        return self.cubes[key]
+
+    def pyramid(self):
+        """Return the AggregatePyramid of the values of interest, building it on first use."""
+        if self.aggregates is None:
+            from src.data_vis.climrr_pyramid import AggregatePyramid
+            self.aggregates = AggregatePyramid(self.df, self.values_of_interests, self.positions)
+        return self.aggregates
+
+
+def dataset_mtime(path):
+    """Return the modification time of the file a dataset is loaded from."""
+    return os.path.getmtime(source_path(path))
+
+
+_datasets = BoundedCache(max_bytes=MAX_CACHE_BYTES, sizeof=lambda dataset: dataset.nbytes)
+_loading_locks = {}
+_registry_lock = threading.Lock()
+_combined_lock = threading.Lock()
+
+
+def dataset_key(path, values_of_interests):
+    return (path, tuple(values_of_interests), dataset_mtime(path))
+
+
+def register_dataset(key, dataset):
+    dataset.mtime = key[2]
+    with _datasets.lock:
+        # Drop copies loaded from an older version of the same file.
+        for stale in [k for k in _datasets.entries if k[:2] == key[:2]]:
+            _datasets.pop(stale)
+        _datasets.put(key, dataset)
+
+
+def get_dataset(path, values_of_interests):
+    """
+    Return the shared ClimRRDataset for a dataset, loading it at most once.
+
+    Entries are keyed by path, columns and file modification time, so all
+    sessions and reruns share one copy until the file on disk changes.
+    Concurrent callers asking for the same dataset wait for a single load.
+    """
+    key = dataset_key(path, values_of_interests)
+    dataset = _datasets.get(key)
+    if dataset is not None:
+        return dataset
+
+    with _registry_lock:
+        lock = _loading_locks.setdefault(key, threading.Lock())
+    with lock:
+        dataset = _datasets.get(key)
+        if dataset is None:
+            dataset = ClimRRDataset(path, values_of_interests)
+            register_dataset(key, dataset)
+    with _registry_lock:
+        _loading_locks.pop(key, None)
+    return dataset
+
+
+def get_datasets(data_infos):
+    """
+    Return the shared ClimRRDataset of several climrr.yml datasets.
+
+    The datasets that are not loaded yet are mapped from the memory-mapped
+    value store, or else read from the combined store in a single pass, so
+    they also share one Crossmodel index; the others are loaded from their
+    own files by get_dataset.
+    """
+    missing = [data_info for data_info in data_infos
+               if dataset_key(data_info['path'], data_info['values_of_interests']) not in _datasets]
+    mapped = [data_info for data_info in missing if is_memory_mapped(data_info)]
+    combined = [data_info for data_info in missing if data_info not in mapped and is_combined(data_info)]
+    if mapped:
+        with _combined_lock:
+            keys, tables = load_value_tables(mapped)
+            for data_info, df in zip(mapped, tables):
+                key = dataset_key(data_info['path'], data_info['values_of_interests'])
+                if key not in _datasets:
+                    dataset = ClimRRDataset(data_info['path'], data_info['values_of_interests'], df, keys if len(df) == len(keys) else None)
+                    register_dataset(key, dataset)
+    if combined:
+        with _combined_lock:
+            for data_info, df in zip(combined, load_combined_tables(combined)):
+                key = dataset_key(data_info['path'], data_info['values_of_interests'])
+                if key not in _datasets:
+                    register_dataset(key, ClimRRDataset(data_info['path'], data_info['values_of_interests'], df))
+    return [get_dataset(data_info['path'], data_info['values_of_interests']) for data_info in data_infos]
+
+
+# Built folium maps keyed by dataset, period, season, scenario, selection and view.
+map_cache = BoundedCache(max_entries=MAX_CACHED_MAPS)
+
+# Analysis results of DataVisualizer.compute keyed by dataset, dataset version and selection.
+result_cache = BoundedCache(max_entries=MAX_CACHED_RESULTS)
+
+
+def clear_datasets():
+    """Drop every dataset held by the registry."""
+    _datasets.clear()
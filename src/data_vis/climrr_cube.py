@@ -0,0 +1,123 @@
+import re
+import numpy as np
+import pandas as pd
+
+SEASONS = ['spring', 'summer', 'autumn', 'winter']
+AXES = ['period', 'season', 'scenario', 'variable']
+
+
+def parse_column(name, periods):
+    """
+    Split a ClimRR column name into its period, season, scenario and variable labels.
+
+    'rcp85_midc_winter' gives period 'midc', season 'winter' and scenario
+    '85'; 'heatindex_M85_Day95' gives period 'M85' and variable 'Day95'.
+    Labels a column does not name are None.
+    """
+    labels = dict.fromkeys(AXES)
+    rest = []
+    for token in name.split('_'):
+        scenario = re.fullmatch(r'rcp(\d+)', token)
+        if token in periods:
+            labels['period'] = token
+        elif token in SEASONS:
+            labels['season'] = token
+        elif scenario:
+            labels['scenario'] = scenario.group(1)
+        else:
+            rest.append(token)
+    if labels['period'] is None:
+        raise ValueError(f"Column {name} names none of the periods {periods}")
+    if rest:
+        labels['variable'] = rest[-1]
+    return labels
+
+
+class ClimRRCube:
+    """
+    The columns of a ClimRR dataset labeled along the period, season, scenario and variable axes.
+
+    Column names are parsed once, so maps, tables and scenario splits pick
+    columns by label instead of by substring. Columns without a scenario
+    (the historical period, or datasets with a single scenario) belong to
+    every scenario. Values stay in the dataset's table; `table` lays out
+    per-column statistics along two axes.
+    """
+    def __init__(self, columns, periods):
+        self.columns = list(columns)
+        self.labels = {col: parse_column(col, periods) for col in self.columns}
+        seen = {axis: [] for axis in AXES}
+        for labels in self.labels.values():
+            for axis in AXES:
+                if labels[axis] not in seen[axis]:
+                    seen[axis].append(labels[axis])
+        scenarios = sorted(s for s in seen['scenario'] if s is not None)
+        self.axes = {
+            'period': [p for p in periods if p in seen['period']],
+            'season': [s for s in SEASONS if s in seen['season']] or [None],
+            'scenario': scenarios or [None],
+            'variable': seen['variable'],
+        }
+        self.slots = {}
+        for col, labels in self.labels.items():
+            for scenario in ([labels['scenario']] if labels['scenario'] is not None else self.axes['scenario']):
+                self.slots[(labels['period'], labels['season'], scenario, labels['variable'])] = col
+
+    def columns_where(self, among=None, **labels):
+        """
+        Return the columns whose labels match `labels`, in column order.
+
+        Matching a scenario also returns the columns that belong to every
+        scenario. `among` restricts the result to a subset of columns.
+        """
+        columns = []
+        for col in self.columns:
+            if among is not None and col not in among:
+                continue
+            own = self.labels[col]
+            if all(own[axis] == label or (axis == 'scenario' and own[axis] is None) for axis, label in labels.items()):
+                columns.append(col)
+        return columns
+
+    def changes(self):
+        """
+        Return the (column, baseline column) pairs of the changes worth comparing, in column order.
+
+        Every later period is compared with the first (historical) period of
+        the same season, scenario and variable; when the dataset has several
+        scenarios, every other scenario is also compared with the first one
+        for the same period, season and variable ('rcp85_midc' with
+        'rcp45_midc').
+        """
+        first_period, first_scenario = self.axes['period'][0], self.axes['scenario'][0]
+        pairs = []
+        for col in self.columns:
+            period, season, scenario, variable = (self.labels[col][axis] for axis in AXES)
+            if period != first_period:
+                pairs.append((col, self.slots.get((first_period, season, scenario or first_scenario, variable))))
+        for col in self.columns:
+            period, season, scenario, variable = (self.labels[col][axis] for axis in AXES)
+            if scenario not in (None, first_scenario):
+                pairs.append((col, self.slots.get((period, season, first_scenario, variable))))
+        return [(col, base) for col, base in pairs if base is not None and base != col]
+
+    def labels_of(self, columns, axis):
+        """Return the distinct labels along `axis` of some columns."""
+        return list(dict.fromkeys(self.labels[col][axis] for col in columns if col in self.labels))
+
+    def table(self, values, rows, columns, **labels):
+        """
+        Lay out per-column values (e.g. the mean of each column) as a table along two axes.
+
+        Axes other than `rows` and `columns` must be fixed by `labels` unless
+        they have a single label. Slots without a column are NaN.
+        """
+        fixed = {axis: labels.get(axis, self.axes[axis][0]) for axis in AXES}
+        data = []
+        for row in self.axes[rows]:
+            data.append([])
+            for column in self.axes[columns]:
+                slot = dict(fixed, **{rows: row, columns: column})
+                col = self.slots.get(tuple(slot[axis] for axis in AXES))
+                data[-1].append(values[col] if col is not None else np.nan)
+        return pd.DataFrame(data, index=self.axes[rows], columns=self.axes[columns])
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import geopandas as gpd
+import shapely
+from src.data_vis.climrr_cache import BoundedCache
+
+GRID_PATH = './data/GridCellsShapefile/GridCells.shp'
+
+# (minimum zoom, simplification tolerance in degrees, decimals kept). The
+# tolerance is about half a screen pixel at the minimum zoom of each tier, so
+# the simplified cells look the same as the full-precision ones in the maps.
+GEOMETRY_TIERS = [
+    (12, 0.0001, 5),
+    (9, 0.001, 4),
+    (6, 0.01, 3),
+    (0, 0.05, 2),
+]
+
+_tiers = BoundedCache(max_entries=len(GEOMETRY_TIERS))
+
+
+def tier_path(min_zoom, grid_path=GRID_PATH):
+    """Return the path of the simplified grid geometry for a zoom tier."""
+    return os.path.splitext(grid_path)[0] + f'_z{min_zoom}.parquet'
+
+
+def tier_for_zoom(zoom):
+    """Return the GEOMETRY_TIERS entry to use at a map zoom level."""
+    for tier in GEOMETRY_TIERS:
+        if zoom >= tier[0]:
+            return tier
+    return GEOMETRY_TIERS[-1]
+
+
+def build_geometry_tiers(grid_path=GRID_PATH):
+    """
+    Write one simplified copy of the grid cells per zoom tier.
+
+    Geometries are reprojected to EPSG:4326 (the CRS folium serializes to),
+    simplified, and rounded so the GeoJSON carries no more digits than the
+    tier can show.
+    """
+    grid = gpd.read_file(grid_path)[['Crossmodel', 'geometry']].to_crs('EPSG:4326')
+    paths = []
+    for min_zoom, tolerance, decimals in GEOMETRY_TIERS:
+        geometry = shapely.simplify(np.asarray(grid.geometry.values), tolerance, preserve_topology=True)
+        geometry = shapely.transform(geometry, lambda coords: np.round(coords, decimals))
+        tier = gpd.GeoDataFrame({'Crossmodel': grid['Crossmodel']}, geometry=geometry, crs=grid.crs)
+        path = tier_path(min_zoom, grid_path)
+        tier.to_parquet(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def load_geometry_tier(zoom, grid_path=GRID_PATH):
+    """Load the grid geometry of the tier for a zoom level, indexed by Crossmodel, or None if it was not built."""
+    min_zoom = tier_for_zoom(zoom)[0]
+    path = tier_path(min_zoom, grid_path)
+    if not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    tier = _tiers.get(key)
+    if tier is None:
+        tier = gpd.read_parquet(path)
+        tier = tier[~tier['Crossmodel'].duplicated()].set_index('Crossmodel').geometry
+        _tiers.put(key, tier)
+    return tier
+
+
+def with_zoom_geometry(geo_df, zoom):
+    """
+    Swap the geometry of a merged geo-frame for the simplified tier that suits the zoom level.
+
+    Cells missing from the tier keep their own geometry; without prebuilt
+    tiers the frame is returned unchanged.
+    """
+    tier = load_geometry_tier(zoom)
+    if tier is None:
+        return geo_df
+    geometry = tier.reindex(geo_df['Crossmodel']).values
+    missing = geometry.isna()
+    if missing.any():
+        original = geo_df.geometry.to_crs(tier.crs).values
+        geometry = gpd.array.from_shapely(np.where(missing, np.asarray(original), np.asarray(geometry)), crs=tier.crs)
+    return gpd.GeoDataFrame(geo_df.drop(columns=geo_df.geometry.name), geometry=geometry, crs=tier.crs)
+
+
+if __name__ == "__main__":
+    for path in build_geometry_tiers():
+        print(path)
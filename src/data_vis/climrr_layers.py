@@ -0,0 +1,226 @@
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+import folium
+from branca.element import MacroElement
+from jinja2 import Template
+from src.data_vis.climrr_cache import BoundedCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# GeoJSON geometry text of the cells of recent maps, keyed by the hash of their geometry.
+_fragments = BoundedCache(max_entries=16)
+
+
+def dumps(obj):
+    """Encode an object as compact JSON text, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def geometry_fragments(geometries):
+    """
+    Return the GeoJSON geometry of each cell as JSON text.
+
+    The maps of one selection draw the same cells, so their geometry is
+    encoded once (by GEOS, without a Python object per coordinate) and
+    reused by every map and rerun.
+    """
+    geometries = np.asarray(geometries)
+    key = hashlib.sha1(b''.join(shapely.to_wkb(geometries))).hexdigest()
+    fragments = _fragments.get(key)
+    if fragments is None:
+        fragments = shapely.to_geojson(geometries)
+        _fragments.put(key, fragments)
+    return fragments
+
+
+def encode_values(values):
+    """
+    Return the JSON text of each value of a column.
+
+    Numbers are encoded in one call for the whole column, other values once
+    per distinct value. Missing values are null and infinities are written
+    as json.dumps writes them, as in GeoDataFrame.__geo_interface__.
+    """
+    values = pd.Series(values)
+    if values.dtype.kind in 'iufb':
+        array = values.to_numpy()
+        text = dumps(array.tolist())[1:-1]
+        encoded = np.array(text.split(','), dtype=object) if len(array) else np.array([], dtype=object)
+        if array.dtype.kind == 'f':
+            encoded[np.isnan(array)] = 'null'
+            infinite = np.isinf(array)
+            encoded[infinite] = [json.dumps(value) for value in array[infinite].tolist()]
+        return encoded
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.array(['null' if pd.isna(value) else dumps(value) for value in uniques.tolist()], dtype=object)[codes]
+
+
+def feature_collection(geo_df, properties):
+    """
+    Return the cells of a geo-frame in EPSG:4326 as the text of a GeoJSON FeatureCollection, with some columns as properties.
+
+    Each feature is spliced together from the pre-encoded geometry of its
+    cell (see geometry_fragments) and the encoded values of its properties,
+    so no GeoJSON dict is built or dumped. Characters that could end the
+    script the text is embedded in are escaped, as Jinja's tojson does.
+    """
+    template = '{"type":"Feature","properties":{' + ','.join(json.dumps(name).replace('%', '%%') + ':%s' for name in properties) + '},"geometry":%s}'
+    columns = [encode_values(geo_df[name]) for name in properties] + [geometry_fragments(geo_df.geometry.values)]
+    text = '{"type":"FeatureCollection","features":[' + ','.join([template % row for row in zip(*columns)]) + ']}'
+    return text.replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+
+class CachedGeoJson(folium.features.GeoJson):
+    """
+    A GeoJson layer that renders its script only once.
+
+    Maps kept in the map cache are never modified after they are built, so the
+    style mapping, JSON dump and template compilation of the first render, as
+    well as the bounds st_folium asks for, are reused every time the map is
+    rendered again.
+    """
+    def _get_self_bounds(self):
+        bounds = getattr(self, '_bounds', None)
+        if bounds is None:
+            bounds = self._bounds = super()._get_self_bounds()
+        return bounds
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        script = getattr(self, '_rendered_script', None)
+        if script is None:
+            super().render(**kwargs)
+            self._rendered_script = figure.script._children[self.get_name()]
+            return
+        figure.script.add_child(script, name=self.get_name())
+        for element in self._children.values():
+            element.render(**kwargs)
+
+
+class SplicedGeoJson(CachedGeoJson):
+    """
+    A GeoJson layer of grid cells embedding the text of feature_collection.
+
+    folium would dump a GeoJSON dict to text twice and map the style of every
+    feature in Python; here the cells are spliced into the script as encoded,
+    and `cell_style`, a Leaflet path style, is applied in the browser with
+    each cell's 'color' property as fill color (and outline color where the
+    style's 'color' is None). Without it, the cells are left for another
+    element, such as LayerSwitch, to style. `data` only holds the names of the
+    properties, which GeoJsonTooltip checks its fields against.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {%- if this.cell_style %}
+        var {{ this.get_name() }}_style = {{ this.cell_style|tojson }};
+        {%- endif %}
+        var {{ this.get_name() }} = L.geoJson({{ '{{ this.text }}' }}{% if this.cell_style %}, {
+            style: function(feature) {
+                var color = feature.properties.color;
+                return Object.assign({fillColor: color}, {{ this.get_name() }}_style, {color: {{ this.get_name() }}_style.color || color});
+            }
+        }{% endif %});
+        {% endmacro %}
+    """)
+
+    def __init__(self, geo_df, properties, cell_style=None, **kwargs):
+        properties = list(dict.fromkeys(properties))
+        super().__init__({'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': dict.fromkeys(properties), 'geometry': None}]}, **kwargs)
+        self._name = 'SplicedGeoJson'
+        self.text = feature_collection(geo_df, properties)
+        self.cell_style = cell_style
+        west, south, east, north = geo_df.total_bounds
+        self._bounds = [[south, west], [north, east]]
+
+    def render(self, **kwargs):
+        # branca compiles the rendered script as a template of its own, and
+        # lexing the cells would cost more than encoding them: the script only
+        # refers to the text, which is inserted when the map is rendered
+        super().render(**kwargs)
+        self.get_root().script._children[self.get_name()].text = self.text
+
+
+class LayerSwitch(MacroElement):
+    """
+    Switch the column a GeoJson layer of grid cells is colored by, in the browser.
+
+    The cells carry the values of every column as properties, and `layers`
+    lists, for each column, its labels along the axes (period, season, ...)
+    and the properties and aliases of its tooltip. A radio group per axis
+    with several labels picks the column shown, so switching periods or
+    seasons restyles the cells without a Streamlit rerun or shipping the
+    geometry again. `color_function` is the source of a JavaScript function
+    mapping a value to a color and `style` the Leaflet path style of every
+    cell, where a None 'color' outlines cells in their fill color.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var cells = {{ this.geojson.get_name() }};
+            var layers = {{ this.layers|tojson }};
+            var axes = {{ this.axes|tojson }};
+            var color = {{ this.color_function }};
+            var style = {{ this.style|tojson }};
+            var active = layers[{{ this.active }}];
+            var selected = Object.assign({}, active.labels);
+            function restyle() {
+                cells.setStyle(function(feature) {
+                    var fillColor = color(feature.properties[active.column]);
+                    return Object.assign({fillColor: fillColor}, style, {color: style.color || fillColor});
+                });
+            }
+            cells.bindTooltip(function(cell) {
+                var properties = cell.feature.properties;
+                return '<table>' + active.fields.map(function(field, i) {
+                    var value = properties[field];
+                    return '<tr><th>' + active.aliases[i] + '&nbsp;</th><td>'
+                        + (typeof value === 'number' ? value.toFixed(2) : value) + '</td></tr>';
+                }).join('') + '</table>';
+            }, {sticky: true});
+            var control = L.control({position: 'topright'});
+            control.onAdd = function() {
+                var div = L.DomUtil.create('div', 'leaflet-control-layers leaflet-control-layers-expanded');
+                axes.forEach(function(axis) {
+                    var group = L.DomUtil.create('div', '', div);
+                    axis.labels.forEach(function(label) {
+                        var item = L.DomUtil.create('label', '', group);
+                        var input = L.DomUtil.create('input', '', item);
+                        input.type = 'radio';
+                        input.name = {{ this.get_name()|tojson }} + '_' + axis.axis;
+                        input.checked = selected[axis.axis] === label.value;
+                        item.appendChild(document.createTextNode(' ' + label.caption + ' '));
+                        L.DomEvent.on(input, 'change', function() {
+                            selected[axis.axis] = label.value;
+                            active = layers.find(function(layer) {
+                                return Object.keys(selected).every(function(key) { return layer.labels[key] === selected[key]; });
+                            }) || active;
+                            restyle();
+                        });
+                    });
+                });
+                L.DomEvent.disableClickPropagation(div);
+                return div;
+            };
+            control.addTo({{ this._parent.get_name() }});
+            restyle();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, geojson, layers, axes, color_function, style, active=0):
+        super().__init__()
+        self._name = 'LayerSwitch'
+        self.geojson = geojson
+        self.layers = layers
+        self.axes = axes
+        self.color_function = color_function
+        self.style = style
+        self.active = active
@@ -0,0 +1,120 @@
+import os
+import numpy as np
+from src.data_vis.climrr_cache import BoundedCache
+from src.data_vis.climrr_stats import merge_moments
+
+# Side, in grid cells, of the blocks of each pyramid level, finest first; each divides the next.
+BLOCK_SIZES = (4, 16, 64)
+# Statistics of selections of at least this many cells are assembled from the pyramid.
+PYRAMID_MIN_CELLS = int(os.environ.get('CLIMRR_PYRAMID_MIN_CELLS', 2000))
+
+# Grid layouts keyed by the identity of the Crossmodel index they were built from.
+_layouts = BoundedCache(max_entries=4)
+
+
+def grid_positions(crossmodels):
+    """
+    Return the row and column numbers of Crossmodel IDs such as 'R12C345', -1 for IDs of another form.
+
+    The IDs are parsed as arrays of code points, without a Python call per ID.
+    """
+    ids = np.ascontiguousarray(np.asarray(crossmodels, dtype=str))
+    chars = ids.view(np.uint32).reshape(len(ids), -1).astype(np.int64)
+    digits = chars - ord('0')
+    is_digit = (digits >= 0) & (digits <= 9)
+    ends = (chars != 0).sum(axis=1)
+    split = np.argmax(chars == ord('C'), axis=1)
+    col = np.arange(chars.shape[1])
+    in_row = (col >= 1) & (col < split[:, None])
+    in_col = (col > split[:, None]) & (col < ends[:, None])
+    valid = (chars[:, 0] == ord('R')) & (split > 1) & (ends > split + 1) & (is_digit | ~(in_row | in_col)).all(axis=1)
+    rows, cols = np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=np.int64)
+    for j in col:
+        rows = np.where(in_row[:, j], rows * 10 + digits[:, j], rows)
+        cols = np.where(in_col[:, j], cols * 10 + digits[:, j], cols)
+    return np.where(valid, rows, -1), np.where(valid, cols, -1)
+
+
+class GridLayout:
+    """
+    The blocks of every pyramid level over the cells of a Crossmodel index, placed on the grid by their R/C numbers.
+
+    `levels` holds, finest first, the block of each cell and the number of
+    cells in each block; `parents` the block one level up of each block.
+    Cells whose ID is not of the R/C form are blocks of their own.
+    """
+    def __init__(self, index):
+        self.index = index
+        rows, cols = grid_positions(index)
+        unplaced = rows < 0
+        self.levels = []
+        self.parents = []
+        for size in BLOCK_SIZES:
+            codes = (rows // size) * (cols.max(initial=0) // size + 1) + cols // size
+            codes = np.where(unplaced, -1 - np.arange(len(index)), codes)
+            blocks = np.unique(codes, return_inverse=True)[1].reshape(-1)
+            if self.levels:
+                parents = np.zeros(len(self.levels[-1][1]), dtype=np.intp)
+                parents[self.levels[-1][0]] = blocks
+                self.parents.append(parents)
+            self.levels.append((blocks, np.bincount(blocks)))
+
+
+def grid_layout(index):
+    """Return the GridLayout of a Crossmodel index, shared by the datasets mapped with the same index."""
+    layout = _layouts.get(id(index))
+    if layout is None or layout.index is not index:
+        layout = GridLayout(index)
+        _layouts.put(id(index), layout)
+    return layout
+
+
+class AggregatePyramid:
+    """
+    Per-column count, sum and M2 (sum of squared deviations from the mean) of blocks of grid cells at several sizes.
+
+    M2 is kept rather than the raw sum of squares, so that merging blocks
+    never subtracts two nearly equal sums. Levels are built bottom-up, each
+    block merging the blocks it covers at the level below, so only the
+    finest level reads the table. `positions` maps Crossmodel IDs to rows of
+    the table, -1 for missing IDs (see ClimRRDataset.positions).
+    """
+    def __init__(self, table, columns, positions):
+        self.table = table
+        self.columns = list(columns)
+        self.positions = positions
+        self.layout = grid_layout(table.index)
+        values = table[self.columns].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        count, total, m2 = valid.astype(float), np.where(valid, values, 0.0), np.zeros(values.shape)
+        self.levels = []
+        for groups in [self.layout.levels[0][0]] + self.layout.parents:
+            count, total, _, m2 = merge_moments(groups, count, total, m2)
+            self.levels.append((count, total, m2))
+
+    def moments(self, ids):
+        """
+        Return the per-column count, sum, mean and M2 of the cells of distinct Crossmodel IDs, ignoring NaNs.
+
+        Blocks whose cells are all selected are taken whole, largest first;
+        only the remaining cells along the edges of the selection are read.
+        The result equals that of batch_moments over the selected rows up to
+        floating-point rounding.
+        """
+        ids = np.asarray(ids)
+        positions = self.positions(ids)
+        if (positions < 0).any():
+            raise KeyError(f"Crossmodel IDs not found in the dataset: {list(ids[positions < 0][:10])}")
+        parts = []
+        for (blocks, cells), (count, total, m2) in reversed(list(zip(self.layout.levels, self.levels))):
+            selected = blocks[positions]
+            complete = np.bincount(selected, minlength=len(cells)) == cells
+            whole = np.flatnonzero(complete)
+            parts.append((count[whole], total[whole], m2[whole]))
+            positions = positions[~complete[selected]]
+        values = self.table.take(positions)[self.columns].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        parts.append((valid.astype(float), np.where(valid, values, 0.0), np.zeros(values.shape)))
+        count, total, m2 = (np.concatenate(arrays) for arrays in zip(*parts))
+        count, total, mean, m2 = merge_moments(np.zeros(len(count), dtype=np.intp), count, total, m2)
+        return count[0], total[0], mean[0], m2[0]
@@ -0,0 +1,238 @@
+import operator
+import numpy as np
+import pandas as pd
+from src.utils import LazyModule
+from src.data_vis.climrr_store import load_climrr_config, has_changes, changes_info, change_names, CONFIG_PATH
+from src.data_vis.climrr_cache import BoundedCache, get_datasets
+from src.data_vis.climrr_utils import fwi_class_codes, FWI_CLASSES
+
+climrr_raster = LazyModule('src.data_vis.climrr_raster')
+
+# Number of condition masks kept by each QueryEngine.
+MAX_CACHED_MASKS = 64
+
+# The only dataset whose values have FWI classes to compare.
+FWI_KEYWORD = 'Fire Weather Index (FWI) projections'
+
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+
+class Query:
+    """
+    A boolean expression over grid cells; combine queries with &, | and ~.
+
+    `evaluate` takes the mask of the cells passing a condition and the mask
+    of the cells having a value for it (see QueryEngine.mask).
+    """
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Condition(Query):
+    """
+    A test on one column of a ClimRR dataset, e.g. Condition('Consecutive Dry Days projections', '>', 30, period='endc', scenario='85').
+
+    The labels (period, season, scenario, variable) must pick exactly one
+    column of the dataset. With `change`, the column's change from the
+    historical period is tested instead (see compute_changes). A threshold
+    naming an FWI class ('High') compares the class of the FWI values, and
+    only applies to the FWI dataset. Cells without a value fail the test,
+    and its negation.
+    """
+    def __init__(self, keyword, op, threshold, change=False, **labels):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op}; use one of {', '.join(OPERATORS)}")
+        if isinstance(threshold, str):
+            if keyword != FWI_KEYWORD or change:
+                raise ValueError(f"FWI class thresholds only apply to the values of {FWI_KEYWORD}, not to {'changes in ' if change else ''}{keyword}")
+            if threshold not in FWI_CLASSES:
+                raise ValueError(f"Unknown FWI class {threshold}; use one of {', '.join(FWI_CLASSES)}")
+        self.keyword = keyword
+        self.op = op
+        self.threshold = threshold
+        self.change = change
+        self.labels = labels
+        self.key = (keyword, op, threshold, change, tuple(sorted(labels.items())))
+
+    def evaluate(self, mask_of, valid_of):
+        return mask_of(self)
+
+    def valid(self, valid_of):
+        return valid_of(self)
+
+    def conditions(self):
+        return [self]
+
+    def __repr__(self):
+        labels = ', '.join(f'{axis}={label}' for axis, label in self.labels.items())
+        return f"{'change in ' if self.change else ''}{self.keyword} ({labels}) {self.op} {self.threshold}"
+
+
+class All(Query):
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def evaluate(self, mask_of, valid_of):
+        return np.logical_and.reduce([part.evaluate(mask_of, valid_of) for part in self.parts])
+
+    def valid(self, valid_of):
+        return np.logical_and.reduce([part.valid(valid_of) for part in self.parts])
+
+    def conditions(self):
+        return [condition for part in self.parts for condition in part.conditions()]
+
+    def __repr__(self):
+        return '(' + ' & '.join(map(repr, self.parts)) + ')'
+
+
+class Any(Query):
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def evaluate(self, mask_of, valid_of):
+        return np.logical_or.reduce([part.evaluate(mask_of, valid_of) for part in self.parts])
+
+    def valid(self, valid_of):
+        return np.logical_and.reduce([part.valid(valid_of) for part in self.parts])
+
+    def conditions(self):
+        return [condition for part in self.parts for condition in part.conditions()]
+
+    def __repr__(self):
+        return '(' + ' | '.join(map(repr, self.parts)) + ')'
+
+
+class Not(Query):
+    """The cells failing a query, among those having a value for every condition of it."""
+    def __init__(self, part):
+        self.part = part
+
+    def evaluate(self, mask_of, valid_of):
+        return ~self.part.evaluate(mask_of, valid_of) & self.part.valid(valid_of)
+
+    def valid(self, valid_of):
+        return self.part.valid(valid_of)
+
+    def conditions(self):
+        return self.part.conditions()
+
+    def __repr__(self):
+        return f'~{self.part!r}'
+
+
+class QueryResult:
+    """
+    The cells matching a query: their number, their fraction of the cells queried and their Crossmodel IDs.
+
+    `conditions` holds the number of queried cells passing each condition,
+    keyed by the condition's description.
+    """
+    def __init__(self, query, crossmodels, total, conditions):
+        self.query = query
+        self.crossmodels = crossmodels
+        self.count = len(crossmodels)
+        self.total = total
+        self.fraction = self.count / total if total else 0.0
+        self.conditions = conditions
+
+    def layer(self, cells, color='#d62728', opacity=0.7, size=None):
+        """
+        Return one map layer drawing the matching cells among `cells`, a geo-frame of Crossmodel and geometry such as the selection.
+
+        The cells are burnt into a single image overlay (see climrr_raster),
+        transparent where the query fails, so the layer weighs the same
+        whatever the number of matches and the rasterized cells are reused
+        by the next query.
+        """
+        matched = pd.Index(self.crossmodels).get_indexer(cells['Crossmodel']) >= 0
+        colored = cells[['Crossmodel', cells.geometry.name]].assign(color=np.where(matched, color, 'rgba(0, 0, 0, 0)'))
+        return climrr_raster.raster_layer(colored, opacity, size or climrr_raster.RASTER_SIZE)
+
+
+class QueryEngine:
+    """
+    Evaluate compound queries over the cells of several ClimRR datasets as vectorized boolean masks.
+
+    The datasets are loaded together (see get_datasets), and the cells of the
+    first one are the cells queried. Each condition becomes a mask over
+    those cells, read straight from the dataset's column when the datasets
+    share one Crossmodel index and aligned once per index otherwise. Masks
+    are cached, so a query only tests the conditions it has not seen.
+    """
+    def __init__(self, keywords, config_path=CONFIG_PATH):
+        config = load_climrr_config(config_path)
+        self.data_infos = {keyword: config[keyword] for keyword in keywords}
+        self.datasets = dict(zip(self.data_infos, get_datasets(list(self.data_infos.values()))))
+        self.reference = next(iter(self.datasets.values()))
+        self.ids = self.reference.df.index.to_numpy()
+        self.alignments = {}
+        self.masks = BoundedCache(max_entries=MAX_CACHED_MASKS)
+
+    def column(self, condition):
+        """Return the dataset and column a condition tests."""
+        data_info = self.data_infos[condition.keyword]
+        cube = self.datasets[condition.keyword].cube(data_info['periods'])
+        columns = cube.columns_where(**condition.labels)
+        if len(columns) != 1:
+            raise ValueError(f"{condition!r} matches the columns {columns}; give labels naming exactly one")
+        col = columns[0]
+        if not condition.change:
+            return self.datasets[condition.keyword], col
+        bases = [base for changed, base in cube.changes() if changed == col and cube.labels[base]['period'] == cube.axes['period'][0]]
+        if not bases or not has_changes(data_info):
+            raise ValueError(f"{condition!r}: the dataset has no change column for {col}")
+        return get_datasets([changes_info(data_info)])[0], change_names(col, bases[0])[0]
+
+    def values(self, dataset, column):
+        """Return the values of a column for the queried cells, NaN for cells the dataset lacks."""
+        values = dataset.df[column].to_numpy(dtype=float)
+        index = dataset.df.index
+        if index is self.reference.df.index:
+            return values
+        if id(index) not in self.alignments:
+            self.alignments[id(index)] = (index, dataset.positions(self.ids))
+        rows = self.alignments[id(index)][1]
+        return np.where(rows >= 0, values[rows], np.nan)
+
+    def mask(self, condition):
+        """Return the masks of the queried cells passing a condition and of those having a value for it."""
+        masks = self.masks.get(condition.key)
+        if masks is None:
+            values = self.values(*self.column(condition))
+            valid = ~np.isnan(values)
+            if isinstance(condition.threshold, str):
+                values, threshold = fwi_class_codes(values), FWI_CLASSES.index(condition.threshold)
+            else:
+                threshold = condition.threshold
+            masks = (OPERATORS[condition.op](values, threshold) & valid, valid)
+            self.masks.put(condition.key, masks)
+        return masks
+
+    def run(self, query, crossmodels=None):
+        """
+        Evaluate a query over the selected cells (all the cells by default) and return its QueryResult.
+
+        `crossmodels` is a selection frame with a Crossmodel column, as the
+        visualizers take, or a sequence of Crossmodel IDs.
+        """
+        if crossmodels is None:
+            positions = slice(None)
+            total = len(self.ids)
+        else:
+            if isinstance(crossmodels, pd.DataFrame):
+                crossmodels = crossmodels['Crossmodel']
+            selected = pd.unique(np.asarray(crossmodels))
+            positions = self.reference.positions(selected)
+            if (positions < 0).any():
+                raise KeyError(f"Crossmodel IDs not found in the dataset: {list(selected[positions < 0][:10])}")
+            total = len(positions)
+        masks = {condition.key: tuple(mask[positions] for mask in self.mask(condition)) for condition in query.conditions()}
+        conditions = {repr(condition): int(masks[condition.key][0].sum()) for condition in query.conditions()}
+        matched = query.evaluate(lambda condition: masks[condition.key][0], lambda condition: masks[condition.key][1])
+        return QueryResult(query, self.ids[positions][matched], total, conditions)
@@ -0,0 +1,123 @@
+import io
+import os
+import re
+import base64
+import hashlib
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely.geometry import box
+from matplotlib import colors as mcolors
+from matplotlib import image as mimage
+from rasterio import features
+from rasterio.transform import from_bounds
+from folium.raster_layers import ImageOverlay
+from src.data_vis.climrr_cache import BoundedCache
+
+# Length in pixels of the longer side of a raster map image.
+RASTER_SIZE = int(os.environ.get('CLIMRR_RASTER_SIZE', 1024))
+# Leaflet draws image overlays in Web Mercator.
+DISPLAY_CRS = 'EPSG:3857'
+
+# Rasterized cells keyed by the hash of their geometry and the image size.
+_rasters = BoundedCache(max_entries=16)
+
+
+def css_to_rgba(color):
+    """Convert a hex color or a CSS 'rgb(r, g, b[, a])' color, as the FWI classes use, to RGBA in 0-1."""
+    match = re.fullmatch(r'rgba?\(([^)]*)\)', color.strip())
+    if match is None:
+        return mcolors.to_rgba(color)
+    channels = [float(channel) for channel in match.group(1).split(',')]
+    return tuple(channel / 255 for channel in channels[:3]) + (channels[3] if len(channels) > 3 else 1.0,)
+
+
+def polygon_shapes(geometries, values):
+    """
+    Return (GeoJSON polygon, value) pairs of (multi)polygons for rasterio.features.rasterize.
+
+    rasterio would read each shapely object through __geo_interface__, which
+    dominates the cost of rasterizing thousands of cells; the coordinates of
+    all polygons are extracted in one vectorized pass instead.
+    """
+    parts, part_index = shapely.get_parts(np.asarray(geometries), return_index=True)
+    rings, ring_index = shapely.get_rings(parts, return_index=True)
+    coords, coord_index = shapely.get_coordinates(rings, return_index=True)
+    coords = coords.tolist()
+    cuts = (np.flatnonzero(np.diff(coord_index)) + 1).tolist()
+    ring_coords = [coords[start:end] for start, end in zip([0] + cuts, cuts + [len(coords)])]
+    cuts = (np.flatnonzero(np.diff(ring_index)) + 1).tolist()
+    return [({'type': 'Polygon', 'coordinates': ring_coords[start:end]}, value)
+            for start, end, value in zip([0] + cuts, cuts + [len(ring_coords)], np.asarray(values)[part_index].tolist())]
+
+
+def rasterize_cells(geometries, size):
+    """
+    Rasterize EPSG:3857 cells so that each pixel holds 1 + the position of the cell covering it, 0 outside the cells.
+
+    The image covers the bounds of the cells, its longer side `size` pixels.
+    Returns the image and its bounds as [[south, west], [north, east]].
+    """
+    key = (hashlib.sha1(b''.join(shapely.to_wkb(np.asarray(geometries)))).hexdigest(), size)
+    cached = _rasters.get(key)
+    if cached is not None:
+        return cached
+    left, bottom, right, top = shapely.total_bounds(np.asarray(geometries))
+    scale = size / max(right - left, top - bottom)
+    width, height = max(1, int(np.ceil((right - left) * scale))), max(1, int(np.ceil((top - bottom) * scale)))
+    positions = features.rasterize(polygon_shapes(geometries, np.arange(1, len(geometries) + 1)), out_shape=(height, width),
+                                   transform=from_bounds(left, bottom, right, top, width, height),
+                                   fill=0, all_touched=True, dtype='int32')
+    west, south, east, north = gpd.GeoSeries([box(left, bottom, right, top)], crs=DISPLAY_CRS).to_crs('EPSG:4326').total_bounds
+    _rasters.put(key, (positions, [[south, west], [north, east]]))
+    return positions, [[south, west], [north, east]]
+
+
+def rasterize_colors(geo_df, size=RASTER_SIZE):
+    """
+    Burn the 'color' column of a geo-frame into an RGBA image, transparent outside the cells.
+
+    Returns the image and its bounds as [[south, west], [north, east]]. The
+    maps of one selection share their geometry, so the cells are only
+    rasterized once for all of them.
+    """
+    cells = geo_df.to_crs(DISPLAY_CRS)
+    positions, bounds = rasterize_cells(cells.geometry.values, size)
+    palette, codes = np.unique(np.asarray(cells['color'], dtype=str), return_inverse=True)
+    lut = np.vstack([np.zeros((1, 4), dtype=np.uint8), (np.array([css_to_rgba(color) for color in palette]) * 255).round().astype(np.uint8)])
+    return lut[np.concatenate([[0], codes + 1])[positions]], bounds
+
+
+def png_url(image):
+    """Return an RGBA image as a PNG data URL."""
+    buf = io.BytesIO()
+    # the flat colors compress well even at the fastest zlib level
+    mimage.imsave(buf, image, format='png', pil_kwargs={'compress_level': 1})
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('utf8')
+
+
+def raster_layer(geo_df, opacity=1.0, size=RASTER_SIZE, **kwargs):
+    """Return an image overlay drawing the cells of a geo-frame in their 'color'; `kwargs` go to ImageOverlay (name, overlay, show, ...)."""
+    image, bounds = rasterize_colors(geo_df, size)
+    return ImageOverlay(png_url(image), bounds=bounds, opacity=opacity, pixelated=True, **kwargs)
+
+
+class CellLookup:
+    """
+    Find the cell under a clicked point of a raster map, which has no per-cell tooltips.
+
+    Holds the tooltip fields of the cells and their spatial index, so a click
+    costs one index query instead of shipping every polygon to the browser.
+    """
+    def __init__(self, geo_df, fields, aliases):
+        self.cells = geo_df[fields + [geo_df.geometry.name]].to_crs('EPSG:4326')
+        self.fields = fields
+        self.aliases = aliases
+
+    def describe(self, lat, lng):
+        """Return {alias: value} of the cell containing a point, or None outside the cells."""
+        hits = self.cells.sindex.query(shapely.Point(lng, lat), predicate='intersects')
+        if len(hits) == 0:
+            return None
+        row = self.cells.iloc[hits[0]]
+        return {alias: row[field] for field, alias in zip(self.fields, self.aliases)}
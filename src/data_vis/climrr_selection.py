@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from src.data_vis.climrr_store import load_climrr_config, CONFIG_PATH
+from src.data_vis.climrr_cache import BoundedCache, get_datasets
+from src.data_vis.climrr_utils import selection_hash
+from src.data_vis.climrr_geometry import with_zoom_geometry, tier_for_zoom
+
+# Number of selections whose display geometry is kept.
+MAX_CACHED_GEOMETRIES = 8
+# Number of sets of datasets whose SelectionLoader is kept.
+MAX_CACHED_LOADERS = 8
+
+# Selected cells in EPSG:4326 at the geometry tier of a zoom level, keyed by selection and tier.
+_geometries = BoundedCache(max_entries=MAX_CACHED_GEOMETRIES)
+
+
+def selection_geometry(crossmodels, zoom):
+    """
+    Return the Crossmodel and display geometry of each selected cell, in the order of its first appearance.
+
+    The geometry is switched to the simplified tier of the zoom level and to
+    EPSG:4326 once per selection and tier, for every dataset and rerun.
+    """
+    key = (selection_hash(crossmodels), tier_for_zoom(zoom)[0])
+    cells = _geometries.get(key)
+    if cells is None:
+        cells = crossmodels[['Crossmodel', crossmodels.geometry.name]]
+        cells = gpd.GeoDataFrame(cells[~cells['Crossmodel'].duplicated()].reset_index(drop=True), crs=crossmodels.crs)
+        cells = with_zoom_geometry(cells, zoom).to_crs('EPSG:4326')
+        _geometries.put(key, cells)
+    return cells
+
+
+class SelectionLoader:
+    """
+    Gather the values of several ClimRR datasets for a selection of grid cells in one pass.
+
+    The datasets are loaded together (see get_datasets), and the positions of
+    the selected cells are looked up once for every dataset sharing the same
+    Crossmodel index. select returns what convert_to_dataframe would for each
+    dataset, so each visualizer only takes its slice of the gathered values.
+    """
+    def __init__(self, keywords, config_path=CONFIG_PATH):
+        config = load_climrr_config(config_path)
+        self.data_infos = {keyword: config[keyword] for keyword in keywords}
+        datasets = get_datasets(list(self.data_infos.values()))
+        self.datasets = dict(zip(self.data_infos, datasets))
+        self.gathered = BoundedCache(max_entries=4)
+
+    def gather(self, crossmodels):
+        """Return the selection table of every dataset, keyed by keyword."""
+        key = selection_hash(crossmodels)
+        tables = self.gathered.get(key)
+        if tables is not None:
+            return tables
+        selected = pd.unique(crossmodels['Crossmodel'])
+        positions = {}
+        tables = {}
+        for keyword, dataset in self.datasets.items():
+            index = dataset.df.index
+            if id(index) not in positions:
+                positions[id(index)] = (index, dataset.positions(selected))
+            indexer = positions[id(index)][1]
+            if (indexer < 0).any():
+                missing = selected[indexer < 0]
+                raise KeyError(f"Crossmodel IDs not found in the dataset: {list(missing[:10])}")
+            # rows first: selecting columns of the whole table would copy it
+            df = dataset.df.take(indexer)[self.data_infos[keyword]['values_of_interests']]
+            df.index = pd.RangeIndex(len(selected))
+            df.insert(0, 'Crossmodel', selected)
+            tables[keyword] = df
+        self.gathered.put(key, tables)
+        return tables
+
+    def select(self, keyword, crossmodels):
+        """Return the values of interest of one dataset for the selected grid cells."""
+        return self.gather(crossmodels)[keyword]
+
+    def join(self, crossmodels, df, zoom):
+        """
+        Join the display geometry of the selected cells with a selection table of `select`.
+
+        The table's rows are in the order of the shared geometry, so its columns
+        are attached as they are; other tables are merged on Crossmodel.
+        """
+        cells = selection_geometry(crossmodels, zoom)
+        if np.array_equal(cells['Crossmodel'].to_numpy(), df['Crossmodel'].to_numpy()):
+            return cells.assign(**{col: df[col].to_numpy() for col in df.columns.drop('Crossmodel')})
+        return gpd.GeoDataFrame(cells.merge(df, on='Crossmodel'), crs=cells.crs)
+
+
+# SelectionLoaders keyed by keywords and config path, with the gathered selections they hold.
+_loaders = BoundedCache(max_entries=MAX_CACHED_LOADERS)
+
+
+def shared_selection_loader(keywords, config_path=CONFIG_PATH):
+    """
+    Return the SelectionLoader of some datasets, shared across reruns and sessions.
+
+    The loader, and the selections it has gathered, are replaced once one
+    of its datasets is reloaded (e.g. after the file changed on disk).
+    """
+    key = (tuple(keywords), config_path)
+    loader = _loaders.get(key)
+    if loader is not None:
+        current = get_datasets(list(loader.data_infos.values()))
+        if all(dataset is loaded for dataset, loaded in zip(current, loader.datasets.values())):
+            return loader
+    loader = SelectionLoader(keywords, config_path)
+    _loaders.put(key, loader)
+    return loader
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+
+def batch_moments(values):
+    """Return the per-column count, sum, mean and M2 of a 2-D array of values, ignoring NaNs."""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0).astype(float)
+    total = np.where(valid, values, 0.0).sum(axis=0)
+    mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    m2 = np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+    return count, total, mean, m2
+
+
+def merge_moments(groups, count, total, m2):
+    """
+    Merge rows of per-column count, sum and M2 into one row per group, ignoring rows with a zero count.
+
+    `groups` holds the group number of each row, from 0 to the number of
+    groups - 1, every group having at least one row. M2 is merged with the
+    parallel form of Welford's update, so no sum of squares is subtracted
+    from another. Returns the count, sum, mean and M2 of each group.
+    """
+    order = np.argsort(groups, kind='stable')
+    starts = np.flatnonzero(np.diff(groups[order], prepend=-1))
+    count, total, m2 = count[order], total[order], m2[order]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        row_mean = np.where(count > 0, total / count, 0.0)
+        group_count = np.add.reduceat(count, starts, axis=0)
+        group_total = np.add.reduceat(total, starts, axis=0)
+        group_mean = np.where(group_count > 0, group_total / group_count, 0.0)
+    spread = count * (row_mean - np.repeat(group_mean, np.diff(starts, append=len(order)), axis=0)) ** 2
+    group_m2 = np.add.reduceat(m2 + spread, starts, axis=0)
+    return group_count, group_total, group_mean, group_m2
+
+
+class RunningStatistics:
+    """
+    Per-column statistics of a set of grid cells that follow the selection as it changes.
+
+    Each value column keeps its count, sum, Welford mean and M2 (sum of squared
+    deviations from the mean). Cells added to or removed from the selection are
+    merged in or taken out as one batch with the parallel form of Welford's
+    update, so an edit costs O(changed cells) rather than a pass over the
+    whole selection. Like pandas, NaNs are skipped.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.reset()
+
+    def reset(self):
+        self.ids = pd.Index([])
+        self.count = np.zeros(len(self.columns))
+        self.sum = np.zeros(len(self.columns))
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
+
+    def add(self, values):
+        self.merge(*batch_moments(values))
+
+    def merge(self, count, total, mean, m2):
+        """Merge the per-column count, sum, mean and M2 of a batch of cells into the statistics."""
+        n = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(n > 0, self.mean + delta * count / n, 0.0)
+            self.m2 = np.where(n > 0, self.m2 + m2 + delta ** 2 * self.count * count / n, 0.0)
+        self.count = n
+        self.sum = self.sum + total
+
+    def remove(self, values):
+        count, total, mean, m2 = batch_moments(values)
+        n = self.count - count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rest_mean = np.where(n > 0, (self.sum - total) / n, 0.0)
+            delta = mean - rest_mean
+            rest_m2 = self.m2 - m2 - delta ** 2 * n * count / self.count
+        self.mean = rest_mean
+        # rounding can leave a tiny negative M2 once few cells remain
+        self.m2 = np.where(n > 1, np.maximum(rest_m2, 0.0), 0.0)
+        self.count = n
+        self.sum = np.where(n > 0, self.sum - total, 0.0)
+
+    def update(self, table, crossmodels, pyramid=None):
+        """
+        Move the statistics to the cells `crossmodels` of a Crossmodel-indexed table.
+
+        Only the cells that entered or left the selection since the last
+        update are read. When most of the selection changed, the statistics
+        are rebuilt from the new selection instead, which costs no more and
+        keeps rounding errors from piling up. A rebuild reads the block
+        aggregates of `pyramid`, an AggregatePyramid of the table, when given.
+        """
+        ids = pd.Index(pd.unique(np.asarray(crossmodels)))
+        added = ids.difference(self.ids)
+        removed = self.ids.difference(ids)
+        if len(added) + len(removed) >= len(ids):
+            self.reset()
+            added, removed = ids, pd.Index([])
+            if pyramid is not None and len(ids) and pyramid.columns == self.columns:
+                self.merge(*pyramid.moments(ids))
+                added = pd.Index([])
+        if len(removed):
+            self.remove(table.loc[removed, self.columns].to_numpy(dtype=float))
+        if len(added):
+            self.add(table.loc[added, self.columns].to_numpy(dtype=float))
+        self.ids = ids
+
+    def summary(self):
+        """Return the per-column mean and sample standard deviation (ddof=1), as DataFrame.mean/std do."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(self.count > 0, self.mean, np.nan)
+            std = np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+        return pd.Series(mean, index=self.columns), pd.Series(std, index=self.columns)
@@ -0,0 +1,332 @@
+import os
+import json
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from src.utils import load_config
+from src.data_vis.climrr_cube import ClimRRCube
+
+CONFIG_PATH = 'src/data_vis/climrr.yml'
+# One wide table of the values of every dataset, keyed by Crossmodel.
+COMBINED_PATH = 'data/climrr/ClimRR_combined.parquet'
+# Memory-mapped copy of the combined store: one .npy file per column, rows sorted by Crossmodel.
+VALUE_STORE_DIR = 'data/climrr/ClimRR_values'
+QUANTILES = [0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0]
+
+
+def load_climrr_config(config_path=CONFIG_PATH):
+    """Load climrr.yml once per process, whether its path is passed or left to the default."""
+    return cached_config(config_path)
+
+
+@lru_cache(maxsize=None)
+def cached_config(config_path):
+    return load_config(config_path)
+
+
+def parquet_path(csv_path):
+    """Return the path of the columnar copy of a ClimRR CSV."""
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+def stats_path(csv_path):
+    """Return the path of the statistics sidecar of a ClimRR CSV."""
+    return os.path.splitext(csv_path)[0] + '.stats.json'
+
+
+def is_up_to_date(derived_path, csv_path):
+    """Check whether a file derived from a CSV exists and is at least as new as the CSV."""
+    if not os.path.exists(derived_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return os.path.getmtime(derived_path) >= os.path.getmtime(csv_path)
+
+
+def is_converted(csv_path):
+    """Check whether an up-to-date Parquet copy of the CSV exists."""
+    return is_up_to_date(parquet_path(csv_path), csv_path)
+
+
+def compute_stats(df, values_of_interests):
+    """
+    Summarize the values of interest of a ClimRR table.
+
+    The global min/max are computed exactly as the visualizers used to, so
+    legends and range text render the same from the sidecar.
+    """
+    values = df[values_of_interests]
+    quantiles = values.quantile(QUANTILES)
+    return {
+        'min': values.min().min().item(),
+        'max': values.max().max().item(),
+        'columns': {
+            col: {
+                'min': values[col].min().item(),
+                'max': values[col].max().item(),
+                'quantiles': {str(q): quantiles.at[q, col].item() for q in QUANTILES},
+                'nulls': int(values[col].isna().sum()),
+            }
+            for col in values_of_interests
+        },
+    }
+
+
+def write_stats(df, data_info, columns=None):
+    output_path = stats_path(data_info['path'])
+    with open(output_path, 'w') as f:
+        json.dump(compute_stats(df, columns or data_info['values_of_interests']), f, indent=2)
+    return output_path
+
+
+def load_stats(path, values_of_interests):
+    """
+    Load the statistics sidecar of a dataset.
+
+    Returns None when the sidecar is missing, older than the CSV or does not
+    cover every value of interest.
+    """
+    sidecar = stats_path(path)
+    if not is_up_to_date(sidecar, path):
+        return None
+    with open(sidecar, 'r') as f:
+        stats = json.load(f)
+    if not set(values_of_interests) <= set(stats['columns']):
+        return None
+    return stats
+
+
+def change_names(col, base):
+    """Return the names of the change columns of a column from its baseline: the difference and the percent change."""
+    return f'{col}_vs_{base}', f'{col}_vs_{base}_pct'
+
+
+def change_columns(data_info):
+    """Return the change columns of a dataset, the difference and percent change of every pair of ClimRRCube.changes."""
+    cube = ClimRRCube(data_info['values_of_interests'], data_info['periods'])
+    return [name for col, base in cube.changes() for name in change_names(col, base)]
+
+
+def compute_changes(df, data_info):
+    """
+    Compute the change columns of a ClimRR table, cell by cell.
+
+    The percent change is relative to the magnitude of the baseline, so it
+    keeps the sign of the difference, and is NaN where the baseline is 0.
+    """
+    cube = ClimRRCube(data_info['values_of_interests'], data_info['periods'])
+    changes = {}
+    for col, base in cube.changes():
+        values, baseline = df[col].to_numpy(dtype=float), df[base].to_numpy(dtype=float)
+        delta, percent = change_names(col, base)
+        changes[delta] = values - baseline
+        with np.errstate(invalid='ignore', divide='ignore'):
+            changes[percent] = np.where(baseline != 0, 100 * (values - baseline) / np.abs(baseline), np.nan)
+    return pd.DataFrame(changes, index=df.index)
+
+
+def has_changes(data_info):
+    """Check whether the Parquet copy of a dataset is up to date and holds its change columns."""
+    path = data_info['path']
+    columns = change_columns(data_info)
+    return bool(columns) and is_converted(path) and set(columns) <= set(pq.read_schema(parquet_path(path)).names)
+
+
+def changes_info(data_info):
+    """Return the climrr.yml entry of a dataset with its change columns as values of interest, to load them like a dataset."""
+    return dict(data_info, values_of_interests=change_columns(data_info))
+
+
+def convert_dataset(data_info):
+    """
+    Write the ClimRR CSV of a climrr.yml entry to a Parquet file and its
+    statistics sidecar.
+
+    Only the Crossmodel key and the values of interest are kept, followed by
+    the change columns (see compute_changes), so change maps and statistics
+    are read rather than computed. The dtypes inferred from the CSV are
+    stored in the Parquet schema, so later loads skip text parsing and type
+    inference altogether.
+    """
+    columns = ['Crossmodel'] + data_info['values_of_interests']
+    df = pd.read_csv(data_info['path'], usecols=columns)
+    df = pd.concat([df[columns], compute_changes(df, data_info)], axis=1)
+    output_path = parquet_path(data_info['path'])
+    df.to_parquet(output_path, index=False)
+    write_stats(df, data_info, data_info['values_of_interests'] + change_columns(data_info))
+    return output_path
+
+
+def convert_all(config_path=CONFIG_PATH):
+    """Convert every dataset listed in climrr.yml."""
+    config = load_config(config_path)
+    converted = {}
+    for keyword, data_info in config.items():
+        converted[keyword] = convert_dataset(data_info)
+    return converted
+
+
+def source_path(path):
+    """Return the file a dataset is loaded from: its Parquet copy when up to date, the CSV otherwise."""
+    return parquet_path(path) if is_converted(path) else path
+
+
+def combined_column(path, col):
+    """Return the name of a dataset column in the combined store, e.g. 'WindSpeed/hist'."""
+    return f"{os.path.splitext(os.path.basename(path))[0]}/{col}"
+
+
+def presence_column(path):
+    """Return the name of the combined store column flagging the cells a dataset has."""
+    return combined_column(path, '')
+
+
+def build_combined_store(config_path=CONFIG_PATH, output_path=COMBINED_PATH):
+    """
+    Write the values of every dataset listed in climrr.yml to one wide Parquet table keyed by Crossmodel.
+
+    Columns are named by combined_column, and include the change columns
+    of the datasets whose Parquet copy has them; datasets sharing a file
+    share its columns. A boolean presence column per file records which cells the
+    file has, so loading a dataset from the store gives the same rows as
+    loading its own file.
+    """
+    columns_by_path = {}
+    for data_info in load_config(config_path).values():
+        columns = columns_by_path.setdefault(data_info['path'], [])
+        columns += [col for col in data_info['values_of_interests'] if col not in columns]
+        if has_changes(data_info):
+            columns += [col for col in change_columns(data_info) if col not in columns]
+    tables = []
+    for path, columns in columns_by_path.items():
+        df = load_climrr_table(path, columns)
+        df = df[~df['Crossmodel'].duplicated()].set_index('Crossmodel')
+        df = df.rename(columns=lambda col: combined_column(path, col))
+        df[presence_column(path)] = True
+        tables.append(df)
+    combined = pd.concat(tables, axis=1, sort=False)
+    for path in columns_by_path:
+        combined[presence_column(path)] = combined[presence_column(path)].fillna(False).astype(bool)
+    combined.index.name = 'Crossmodel'
+    combined.reset_index().to_parquet(output_path, index=False)
+    return output_path
+
+
+def is_combined(data_info, combined_path=COMBINED_PATH):
+    """Check whether the combined store holds every value of interest of a dataset and is at least as new as its file."""
+    path = data_info['path']
+    if not os.path.exists(combined_path) or not is_up_to_date(combined_path, source_path(path)):
+        return False
+    names = set(pq.read_schema(combined_path).names)
+    return {presence_column(path)} | {combined_column(path, col) for col in data_info['values_of_interests']} <= names
+
+
+def load_combined_tables(data_infos, combined_path=COMBINED_PATH):
+    """
+    Load the values of several datasets from the combined store in one read.
+
+    Returns one table per dataset, indexed by Crossmodel, with the dataset's
+    own column names. Datasets that cover every cell of the store share the
+    same index object.
+    """
+    columns = ['Crossmodel']
+    for data_info in data_infos:
+        columns += [combined_column(data_info['path'], col) for col in data_info['values_of_interests']]
+        columns.append(presence_column(data_info['path']))
+    combined = pd.read_parquet(combined_path, columns=list(dict.fromkeys(columns))).set_index('Crossmodel')
+    tables = []
+    for data_info in data_infos:
+        path, values_of_interests = data_info['path'], data_info['values_of_interests']
+        df = combined[[combined_column(path, col) for col in values_of_interests]]
+        df.columns = values_of_interests
+        present = combined[presence_column(path)]
+        tables.append(df if present.all() else df[present.to_numpy()])
+    return tables
+
+
+def value_file(column, store_dir=VALUE_STORE_DIR):
+    """Return the .npy file of a combined store column, e.g. 'WindSpeed/hist.npy' or 'WindSpeed/_present.npy'."""
+    if column.endswith('/'):
+        column += '_present'
+    return os.path.join(store_dir, column + '.npy')
+
+
+def keys_file(store_dir=VALUE_STORE_DIR):
+    return os.path.join(store_dir, 'Crossmodel.npy')
+
+
+def save_array(path, array):
+    """Write an array with np.save through a temporary file, so processes mapping the old file keep reading it intact."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def build_value_store(combined_path=COMBINED_PATH, store_dir=VALUE_STORE_DIR):
+    """
+    Write the combined store as read-only arrays that every process can memory-map.
+
+    Each column becomes a .npy file (see value_file) keeping its dtype, with
+    rows sorted by Crossmodel; the sorted Crossmodel IDs are saved as a
+    fixed-width string array, so IDs are found by binary search. The key file
+    is written last and its modification time stands for the whole store.
+    """
+    combined = pd.read_parquet(combined_path).sort_values('Crossmodel', kind='stable')
+    for column in combined.columns.drop('Crossmodel'):
+        save_array(value_file(column, store_dir), combined[column].to_numpy())
+    save_array(keys_file(store_dir), combined['Crossmodel'].to_numpy(dtype=str))
+    return store_dir
+
+
+def is_memory_mapped(data_info, store_dir=VALUE_STORE_DIR):
+    """Check whether the value store holds every value of interest of a dataset and is at least as new as its file."""
+    path = data_info['path']
+    if not is_up_to_date(keys_file(store_dir), source_path(path)) or not is_up_to_date(keys_file(store_dir), COMBINED_PATH):
+        return False
+    columns = [presence_column(path)] + [combined_column(path, col) for col in data_info['values_of_interests']]
+    return all(os.path.exists(value_file(column, store_dir)) for column in columns)
+
+
+def load_value_tables(data_infos, store_dir=VALUE_STORE_DIR):
+    """
+    Map the values of several datasets from the value store.
+
+    Returns the sorted Crossmodel keys and one table per dataset, indexed by
+    Crossmodel, whose columns are read-only views of the mapped files: the
+    values are never parsed or copied, and processes mapping the same files
+    share their pages. Datasets missing some cells of the store get a copy
+    of their own rows instead.
+    """
+    keys = np.load(keys_file(store_dir), mmap_mode='r')
+    index = pd.Index(keys, name='Crossmodel')
+    tables = []
+    for data_info in data_infos:
+        path, values_of_interests = data_info['path'], data_info['values_of_interests']
+        columns = {col: np.load(value_file(combined_column(path, col), store_dir), mmap_mode='r') for col in values_of_interests}
+        df = pd.DataFrame(columns, index=index, copy=False)
+        present = np.load(value_file(presence_column(path), store_dir), mmap_mode='r')
+        tables.append(df if present.all() else df[np.asarray(present)])
+    return keys, tables
+
+
+def load_climrr_table(path, values_of_interests):
+    """
+    Load the Crossmodel key and the values of interest of a ClimRR dataset.
+
+    Reads only the requested columns from the Parquet copy when it is present
+    and up to date, and falls back to the CSV otherwise.
+    """
+    columns = values_of_interests + ['Crossmodel']
+    if is_converted(path):
+        return pd.read_parquet(parquet_path(path), columns=columns)
+    return pd.read_csv(path, usecols=columns)[columns]
+
+
+if __name__ == "__main__":
+    for keyword, output_path in convert_all().items():
+        print(f"{keyword}: {output_path}")
+    print(f"combined: {build_combined_store()}")
+    print(f"memory-mapped: {build_value_store()}")
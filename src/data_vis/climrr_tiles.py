@@ -0,0 +1,250 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import threading
+import http.server
+from functools import partial
+import geopandas as gpd
+import mercantile
+import mapbox_vector_tile
+from mapbox_vector_tile.Mapbox import vector_tile_pb2
+import shapely
+from shapely.geometry import box
+from folium.plugins import VectorGridProtobuf
+from src.utils import load_config
+from src.data_vis.climrr_store import CONFIG_PATH, load_climrr_table
+from src.data_vis.climrr_geometry import GRID_PATH
+from src.data_vis.climrr_cache import BoundedCache
+from src.data_vis.climrr_utils import dataset_slug
+
+TILE_DIR = './data/tiles'
+TILE_ZOOMS = range(4, 11)
+TILE_LAYER = 'cells'
+TILE_EXTENT = 4096
+# Features are clipped slightly outside each tile so that cell borders do not show seams.
+TILE_BUFFER = 64
+TILE_PORT = int(os.environ.get('CLIMRR_TILE_PORT', 8765))
+# Interface the tile server listens on; only this machine by default.
+TILE_HOST = os.environ.get('CLIMRR_TILE_HOST', '127.0.0.1')
+# URL under which the browser reaches the tile server.
+TILE_URL = os.environ.get('CLIMRR_TILE_URL', f'http://localhost:{TILE_PORT}')
+# Selections registered with the tile server, under the tile directory (no dataset slug starts with '_').
+SELECTION_DIR = '_selections'
+SELECTED_TILE = re.compile(r'^/([a-z0-9_]+)/([0-9a-f]{16})/(\d+)/(\d+)/(\d+)\.pbf$')
+MAX_CACHED_SELECTIONS = 32
+
+
+def has_tile_cache(keyword, tile_dir=TILE_DIR):
+    return os.path.isdir(os.path.join(tile_dir, dataset_slug(keyword)))
+
+
+def encode_tile(cells, sindex, tile):
+    """Encode the cells intersecting a tile as a Mapbox Vector Tile, or return None for an empty tile."""
+    bounds = mercantile.xy_bounds(tile)
+    margin = (bounds.right - bounds.left) * TILE_BUFFER / TILE_EXTENT
+    clip = (bounds.left - margin, bounds.bottom - margin, bounds.right + margin, bounds.top + margin)
+    hits = sindex.query(box(*clip), predicate='intersects')
+    if len(hits) == 0:
+        return None
+
+    geometries = shapely.clip_by_rect(cells.geometry.values[hits], *clip)
+    properties = cells.drop(columns='geometry').iloc[hits].to_dict('records')
+    features = [{'geometry': geometry, 'properties': props} for geometry, props in zip(geometries, properties)]
+    return mapbox_vector_tile.encode(
+        [{'name': TILE_LAYER, 'features': features}],
+        default_options={'quantize_bounds': tuple(bounds), 'extents': TILE_EXTENT},
+    )
+
+
+def build_tile_cache(keyword, data_info, grid, zooms=TILE_ZOOMS, tile_dir=TILE_DIR):
+    """
+    Pre-generate the vector tiles of one ClimRR dataset.
+
+    Every tile feature is a grid cell carrying its Crossmodel ID and the values
+    of every period/season/scenario column, so one tile set serves all maps of
+    the dataset. Tiles are written to <tile_dir>/<dataset>/<z>/<x>/<y>.pbf.
+    """
+    values = load_climrr_table(data_info['path'], data_info['values_of_interests'])
+    cells = grid.merge(values, on='Crossmodel')
+    sindex = cells.sindex
+    west, south, east, north = cells.to_crs('EPSG:4326').total_bounds
+    output_dir = os.path.join(tile_dir, dataset_slug(keyword))
+    count = 0
+    for zoom in zooms:
+        for tile in mercantile.tiles(west, south, east, north, zoom):
+            data = encode_tile(cells, sindex, tile)
+            if data is None:
+                continue
+            path = os.path.join(output_dir, str(tile.z), str(tile.x), f'{tile.y}.pbf')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            count += 1
+    return count
+
+
+def build_all_tile_caches(config_path=CONFIG_PATH, grid_path=GRID_PATH, zooms=TILE_ZOOMS, tile_dir=TILE_DIR):
+    config = load_config(config_path)
+    grid = gpd.read_file(grid_path)[['Crossmodel', 'geometry']].to_crs('EPSG:3857')
+    return {keyword: build_tile_cache(keyword, data_info, grid, zooms, tile_dir) for keyword, data_info in config.items()}
+
+
+def register_selection(selected_ids, tile_dir=TILE_DIR):
+    """
+    Save a set of selected Crossmodel IDs for the tile server and return the key naming it in tile URLs.
+
+    Selections are files under the tile directory, written once per set of
+    IDs, so every process serving that directory finds them.
+    """
+    text = '\n'.join(sorted(set(map(str, selected_ids))))
+    key = hashlib.sha1(text.encode()).hexdigest()[:16]
+    path = os.path.join(tile_dir, SELECTION_DIR, f'{key}.txt')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    return key
+
+
+_selections = BoundedCache(max_entries=MAX_CACHED_SELECTIONS)
+
+
+def load_selection(key, tile_dir=TILE_DIR):
+    """Return the set of Crossmodel IDs registered under a key, or None if there is none."""
+    path = os.path.join(tile_dir, SELECTION_DIR, f'{key}.txt')
+    selected = _selections.get(path)
+    if selected is None:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            selected = frozenset(f.read().split('\n'))
+        _selections.put(path, selected)
+    return selected
+
+
+def filter_tile(data, selected):
+    """Keep the features of an encoded tile whose Crossmodel is selected, without decoding their geometry."""
+    tile = vector_tile_pb2.tile()
+    tile.ParseFromString(data)
+    for layer in tile.layers:
+        if 'Crossmodel' not in layer.keys:
+            continue
+        key = list(layer.keys).index('Crossmodel')
+        kept_values = {index for index, value in enumerate(layer.values) if value.string_value in selected}
+        features = [feature for feature in layer.features
+                    if any(feature.tags[i] == key and feature.tags[i + 1] in kept_values for i in range(0, len(feature.tags), 2))]
+        del layer.features[:]
+        layer.features.extend(features)
+    return tile.SerializeToString() if any(layer.features for layer in tile.layers) else b''
+
+
+class TileRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serve the cached tiles of registered selections; tiles that were never generated are empty, not missing.
+
+    /<dataset>/<key>/<z>/<x>/<y>.pbf serves a tile with only the cells of the
+    selection registered under `key` (see register_selection). Nothing else
+    of the tile directory is served: not the full tiles, the registered
+    selections nor directory listings.
+    """
+    def do_GET(self):
+        match = SELECTED_TILE.match(self.path)
+        selected = load_selection(match.group(2), self.directory) if match is not None else None
+        if selected is None:
+            self.send_error(404)
+            return
+        slug, key, z, x, y = match.groups()
+        path = os.path.join(self.directory, slug, z, x, f'{y}.pbf')
+        data = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = filter_tile(f.read(), selected)
+        self.send_tile(data)
+
+    def do_HEAD(self):
+        self.send_error(405)
+
+    def send_tile(self, data):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-protobuf')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def end_headers(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def ensure_tile_server(tile_dir=TILE_DIR, port=TILE_PORT, host=TILE_HOST):
+    """
+    Start the tile server on a daemon thread once per process and return its URL.
+
+    If the port is already taken, another worker process is assumed to be
+    serving the same tile directory.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = http.server.ThreadingHTTPServer((host, port), partial(TileRequestHandler, directory=tile_dir))
+            except OSError:
+                return TILE_URL
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return TILE_URL
+
+
+def tile_layer(keyword, value_column, color_function, style, selected_ids, name=None):
+    """
+    Build a folium layer drawing the selected cells of a dataset from its vector tiles.
+
+    `color_function` is the source of a JavaScript function mapping a value to
+    a color, and `style` the Leaflet path style of every cell, where a None
+    'color' outlines cells in their fill color. The selected Crossmodel IDs
+    are registered with the tile server, which only serves their cells, so
+    the map embeds neither geometry nor IDs, whatever the selection size.
+    """
+    key = register_selection(selected_ids)
+    url = f"{ensure_tile_server()}/{dataset_slug(keyword)}/{key}/{{z}}/{{x}}/{{y}}.pbf"
+    options = f"""{{
+        maxNativeZoom: {max(TILE_ZOOMS)},
+        minNativeZoom: {min(TILE_ZOOMS)},
+        vectorTileLayerStyles: {{
+            {TILE_LAYER}: (function() {{
+                var color = {color_function};
+                var style = {json.dumps(style)};
+                return function(properties, zoom) {{
+                    var fillColor = color(properties[{json.dumps(value_column)}]);
+                    return Object.assign({{fill: true, fillColor: fillColor}}, style, {{color: style.color || fillColor}});
+                }};
+            }})()
+        }}
+    }}"""
+    return VectorGridProtobuf(url, name or value_column, options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and serve ClimRR vector tiles')
+    parser.add_argument('--zooms', type=int, nargs='+', default=list(TILE_ZOOMS), help='Zoom levels to pre-generate')
+    parser.add_argument('--serve', action='store_true', help='Serve the tile cache instead of building it')
+    parser.add_argument('--host', default=TILE_HOST, help='Interface to serve the tiles on')
+    args = parser.parse_args()
+    if args.serve:
+        server = http.server.ThreadingHTTPServer((args.host, TILE_PORT), partial(TileRequestHandler, directory=TILE_DIR))
+        print(f"Serving {TILE_DIR} on {args.host}:{TILE_PORT}")
+        server.serve_forever()
+    else:
+        for keyword, count in build_all_tile_caches(zooms=args.zooms).items():
+            print(f"{keyword}: {count} tiles")
@@ -1,5 +1,21 @@
+import re
+import hashlib
+import numpy as np
 import pandas as pd
 
+# Upper bounds of the FWI classes; values above the last bound are 'Very Extreme'.
+FWI_BINS = [9, 21, 34, 39, 53]
+FWI_CLASSES = ['Low', 'Medium', 'High', 'Very High', 'Extreme', 'Very Extreme']
+FWI_CLASS_COLORS = {
+    'Low': 'rgb(255, 255, 0, 0.5)',
+    'Medium': 'rgb(255, 204, 0, 0.5)',
+    'High': 'rgb(255, 153, 0, 0.5)',
+    'Very High': 'rgb(255, 102, 0, 0.5)',
+    'Extreme': 'rgb(255, 51, 0, 0.5)',
+    'Very Extreme': 'rgb(255, 0, 0, 0.5)'
+}
+HEX_DIGITS = np.array([format(i, '02x') for i in range(256)])
+
 def categorize_fwi(value):
         """Categorize the FWI value into its corresponding class and return the value and category."""
         if value <= 9:
@@ -16,36 +32,112 @@ def categorize_fwi(value):
             return 'Very Extreme'
     
 def fwi_color(value):
-    fwi_class_colors = {
-        'Low': 'rgb(255, 255, 0, 0.5)',
-        'Medium': 'rgb(255, 204, 0, 0.5)',
-        'High': 'rgb(255, 153, 0, 0.5)',
-        'Very High': 'rgb(255, 102, 0, 0.5)',
-        'Extreme': 'rgb(255, 51, 0, 0.5)',
-        'Very Extreme': 'rgb(255, 0, 0, 0.5)'
-    }
-    return fwi_class_colors[categorize_fwi(value)]
+    return FWI_CLASS_COLORS[categorize_fwi(value)]
+
+def fwi_class_codes(values):
+    """Return the index into FWI_CLASSES of each value; NaN falls in the last class like in categorize_fwi."""
+    return np.searchsorted(FWI_BINS, np.asarray(values, dtype=float), side='left')
+
+def categorize_fwi_array(values):
+    """Vectorized categorize_fwi over an array of FWI values."""
+    return np.array(FWI_CLASSES, dtype=object)[fwi_class_codes(values)]
+
+def fwi_colors(values):
+    """Vectorized fwi_color over an array of FWI values."""
+    lookup = np.array([FWI_CLASS_COLORS[fwi_class] for fwi_class in FWI_CLASSES], dtype=object)
+    return lookup[fwi_class_codes(values)]
+
+def colormap_hex(color_scale, normalized_values):
+    """
+    Vectorized `mcolors.rgb2hex(color_scale(value))` over an array of values.
+
+    The colormap maps the whole array through its lookup table at once, and the
+    channels are rounded and turned into hex digits with another lookup table.
+    """
+    rgba = color_scale(np.asarray(normalized_values, dtype=float))
+    digits = HEX_DIGITS[np.round(rgba[..., :3] * 255).astype(int)]
+    return ('#' + pd.Series(digits[..., 0]) + digits[..., 1] + digits[..., 2]).to_numpy(dtype=object)
+
+def dataset_slug(keyword):
+    """Return the file or directory name of a dataset, e.g. 'wind_speed_projections'."""
+    return re.sub(r'[^a-z0-9]+', '_', keyword.lower()).strip('_')
 
 def subset_by_crossmodel(df, crossmodel):
     subset = df[df['Crossmodel'] == crossmodel].iloc[0]
     return subset
 
+def index_by_crossmodel(df):
+    """Index a ClimRR table by Crossmodel, keeping the first row of duplicated IDs."""
+    return df[~df['Crossmodel'].duplicated()].set_index('Crossmodel')
+
 def convert_to_dataframe(df, values_of_interests, crossmodels):
-    data_dict = {}
-    for crossmodel in crossmodels['Crossmodel']:
-        value = df[df['Crossmodel'] == crossmodel].iloc[0]
-        data_dict[crossmodel] = value
+    """
+    Gather the rows of the selected grid cells in one vectorized lookup.
 
-    data_rows = []
+    `df` is either a ClimRR table with a Crossmodel column or one already
+    indexed by Crossmodel (see `index_by_crossmodel`); the indexed form avoids
+    rebuilding the index on every call. Each selected cell appears once, in
+    the order of its first appearance in `crossmodels`.
+    """
+    if df.index.name != 'Crossmodel':
+        df = index_by_crossmodel(df)
+    selected = pd.unique(crossmodels['Crossmodel'])
+    positions = df.index.get_indexer(selected)
+    if (positions < 0).any():
+        missing = selected[positions < 0]
+        raise KeyError(f"Crossmodel IDs not found in the dataset: {list(missing[:10])}")
 
-    columns = ['Crossmodel'] + values_of_interests
-    
-    for crossmodel, index_values in data_dict.items():
-        row = [crossmodel]
-        
-        row += [index_values[key] for key in values_of_interests]
-        
-        data_rows.append(row)
-    
-    df = pd.DataFrame(data_rows, columns=columns)
-    return df
\ No newline at end of file
+    df = df.take(positions)[values_of_interests]
+    df.index = pd.RangeIndex(len(selected))
+    df.insert(0, 'Crossmodel', selected)
+    return df
+
+def sorted_positions(keys, ids):
+    """
+    Index.get_indexer for a sorted array of Crossmodel keys: the position of each ID, -1 when missing.
+
+    A binary search over the keys needs no hash table, so a memory-mapped
+    key array is searched as it is.
+    """
+    ids = np.asarray(ids, dtype=str)
+    if len(keys) == 0:
+        return np.full(len(ids), -1)
+    positions = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+    return np.where(keys[positions] == ids, positions, -1)
+
+def selection_hash(crossmodels):
+    """Hash the set of selected Crossmodel IDs, independently of their order and duplicates."""
+    selected = pd.Series(np.sort(pd.unique(crossmodels['Crossmodel'])))
+    return hashlib.sha1(pd.util.hash_pandas_object(selected, index=False).values.tobytes()).hexdigest()
+
+def top_k(values, k, largest=True):
+    """
+    Return the positions of the k largest (or smallest) values, from the most extreme, ignoring NaNs.
+
+    np.argpartition finds the k values in linear time, and only those are sorted.
+    """
+    values = np.asarray(values, dtype=float)
+    candidates = np.flatnonzero(~np.isnan(values))
+    k = min(k, len(candidates))
+    if k <= 0:
+        return candidates[:0]
+    keys = -values[candidates] if largest else values[candidates]
+    top = np.argpartition(keys, k - 1)[:k]
+    return candidates[top[np.argsort(keys[top], kind='stable')]]
+
+def hotspots(df, column, crossmodels, k, largest=True, positions=None):
+    """
+    Return the k selected grid cells with the largest (or smallest) value of a column, as Crossmodel and value.
+
+    `df` is a table indexed by Crossmodel and `positions` the function
+    finding its rows (e.g. ClimRRDataset.positions), get_indexer by default.
+    Only the column's values of the selected cells are gathered.
+    """
+    selected = pd.unique(np.asarray(crossmodels))
+    rows = (positions or df.index.get_indexer)(selected)
+    if (rows < 0).any():
+        missing = selected[rows < 0]
+        raise KeyError(f"Crossmodel IDs not found in the dataset: {list(missing[:10])}")
+    values = df[column].to_numpy()[rows]
+    top = top_k(values, k, largest)
+    return pd.DataFrame({'Crossmodel': selected[top], column: values[top]})
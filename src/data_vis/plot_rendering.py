@@ -0,0 +1,63 @@
+import os
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from kaleido.scopes.plotly import PlotlyScope
+from src.data_vis.climrr_cache import BoundedCache
+
+# Number of kaleido processes rendering figures concurrently.
+RENDER_WORKERS = int(os.environ.get('CLIMRR_RENDER_WORKERS', 2))
+# Number of rendered images kept by the plot cache.
+MAX_CACHED_PLOTS = int(os.environ.get('CLIMRR_PLOT_CACHE_ENTRIES', 256))
+
+rendered_plots = BoundedCache(max_entries=MAX_CACHED_PLOTS)
+
+_workers = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def figure_key(fig, format='png'):
+    """Return the cache key of a figure: a hash of its full JSON spec and the image format."""
+    return hashlib.sha1(fig.to_json().encode('utf8')).hexdigest(), format
+
+
+def _start_worker():
+    # kaleido serializes the requests of a scope, so each worker thread drives its own process
+    _workers.scope = PlotlyScope()
+
+
+def _render(fig, format):
+    image_bytes = _workers.scope.transform(fig, format=format)
+    return base64.b64encode(image_bytes).decode('utf8')
+
+
+def get_executor():
+    """Return the process-wide pool of rendering threads, starting it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, initializer=_start_worker,
+                                           thread_name_prefix='kaleido')
+    return _executor
+
+
+def render_figures(figs, format='png'):
+    """
+    Render plotly figures to base64-encoded images, in the order given.
+
+    Figures are rendered in parallel on the worker pool, and images are cached
+    by figure spec, so a figure drawn again on a later rerun or by another
+    session is not sent to kaleido twice.
+    """
+    keys = [figure_key(fig, format) for fig in figs]
+    images = {key: rendered_plots.get(key) for key in keys}
+    pending = {}
+    for key, fig in zip(keys, figs):
+        if images[key] is None and key not in pending:
+            pending[key] = get_executor().submit(_render, fig, format)
+    for key, future in pending.items():
+        images[key] = future.result()
+        rendered_plots.put(key, images[key])
+    return [images[key] for key in keys]
@@ -1,8 +1,24 @@
 import yaml
 import time
+import importlib
 import streamlit as st
 TEXT_CURSOR = "▕"
 
+
+class LazyModule:
+    """
+    A stand-in for a module that is only imported on first attribute access.
+
+    `plt = LazyModule('matplotlib.pyplot')` keeps `plt.subplots(...)` working
+    while moving the import cost from module load to first use. Imports go
+    through importlib, so concurrent first uses from several threads are safe.
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
 def load_config(path):
     """
     This function loads the config file.
@@ -0,0 +1,46 @@
+import os
+import shutil
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from benchmarks.climrr_visualizers import synthetic_grid, write_synthetic_tables
+from src.data_vis.climrr_cache import clear_datasets, map_cache, result_cache
+from src.data_vis.climrr_store import CONFIG_PATH, compute_changes, load_climrr_config, parquet_path
+
+
+@pytest.fixture
+def synthetic_store(tmp_path, monkeypatch):
+    """
+    Write random ClimRR tables of a synthetic 100-cell grid under a temporary working directory.
+
+    Yields the selection frame of the grid, the config and `edit(keyword,
+    crossmodel, **values)`, which sets values of a cell of a dataset and
+    recomputes its change columns.
+    """
+    config_path = tmp_path / CONFIG_PATH
+    config_path.parent.mkdir(parents=True)
+    shutil.copy(CONFIG_PATH, config_path)
+    monkeypatch.chdir(tmp_path)
+    config = load_climrr_config(os.path.abspath(CONFIG_PATH))
+    selection = synthetic_grid(100)
+    write_synthetic_tables(config, selection['Crossmodel'])
+
+    def edit(keyword, crossmodel, **values):
+        data_info = config[keyword]
+        path = parquet_path(data_info['path'])
+        df = pd.read_parquet(path)
+        row = df.index[df['Crossmodel'] == crossmodel]
+        for column, value in values.items():
+            df.loc[row, column] = value
+        changes = compute_changes(df, data_info)
+        df[changes.columns] = changes
+        df.to_parquet(path, index=False)
+        clear_datasets()
+
+    clear_datasets()
+    map_cache.clear()
+    result_cache.clear()
+    yield SimpleNamespace(selection=selection, config=config, config_path=os.path.abspath(CONFIG_PATH), edit=edit)
+    clear_datasets()
+    map_cache.clear()
+    result_cache.clear()
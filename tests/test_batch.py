@@ -0,0 +1,30 @@
+import json
+import pandas as pd
+from src.data_vis.batch import analyze_region, region_dir_name
+
+CDD = 'Consecutive Dry Days projections'
+
+
+def test_region_dir_names_do_not_collide():
+    assert region_dir_name('St. Louis') != region_dir_name('St Louis')
+    assert region_dir_name('St. Louis').startswith('st_louis_')
+    assert region_dir_name('東京').startswith('region_')
+
+
+def test_region_without_cells_gets_an_empty_summary(synthetic_store, tmp_path):
+    region_dir = analyze_region('Open sea', [], [CDD], str(tmp_path / 'output'), config_path=synthetic_store.config_path)
+    with open(f'{region_dir}/summary.json') as f:
+        summary = json.load(f)
+    assert summary['cells'] == 0
+    assert set(summary['datasets'][CDD]['mean'].values()) == {None}
+    assert pd.read_parquet(f'{region_dir}/consecutive_dry_days_projections.parquet').empty
+
+
+def test_region_summary_matches_selected_rows(synthetic_store, tmp_path):
+    crossmodels = list(synthetic_store.selection['Crossmodel'][:10])
+    region_dir = analyze_region(3, crossmodels, [CDD], str(tmp_path / 'output'), config_path=synthetic_store.config_path)
+    with open(f'{region_dir}/summary.json') as f:
+        summary = json.load(f)
+    table = pd.read_parquet(f'{region_dir}/consecutive_dry_days_projections.parquet')
+    assert list(table['Crossmodel']) == crossmodels
+    assert summary['datasets'][CDD]['mean']['hist'] == table['hist'].mean()
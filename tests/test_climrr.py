@@ -0,0 +1,54 @@
+import threading
+from types import SimpleNamespace
+import folium
+import numpy as np
+import pytest
+from src.data_vis import climrr
+from src.data_vis.climrr import ClimRRAnnualProjectionsCDNP
+
+CDD = 'Consecutive Dry Days projections'
+
+
+def test_mean_percent_change_is_relative_to_mean_baseline(synthetic_store):
+    synthetic_store.edit(CDD, 'R1C1', hist=0.001)
+    visualizer = ClimRRAnnualProjectionsCDNP()
+    df = visualizer.select(synthetic_store.selection)
+    changes = visualizer.calculate_changes(df)
+    delta = df['rcp85_endc'] - df['hist']
+    expected = 100 * delta.mean() / df['hist'].abs().mean()
+    assert np.isclose(changes.loc['rcp85_endc vs hist', 'Mean change (%)'], expected)
+    assert abs(changes.loc['rcp85_endc vs hist', 'Mean change (%)']) < 1000
+
+
+def test_show_map_renders_under_the_map_lock(synthetic_store, monkeypatch):
+    m = SimpleNamespace(render_lock=threading.Lock())
+    held = []
+    monkeypatch.setattr(climrr, 'streamlit_folium', SimpleNamespace(st_folium=lambda m, **kwargs: held.append(m.render_lock.locked())))
+    ClimRRAnnualProjectionsCDNP().show_map(m, height=450)
+    assert held == [True] and not m.render_lock.locked()
+
+
+def test_compute_gives_each_caller_its_own_prompt(synthetic_store):
+    visualizer = ClimRRAnnualProjectionsCDNP()
+    first = visualizer.compute(synthetic_store.selection)
+    first.messages.append({'role': 'user', 'content': 'Here is my profile'})
+    second = visualizer.compute(synthetic_store.selection)
+    assert len(second.messages) == len(first.messages) - 1
+    assert second.df is first.df
+
+
+def test_prompt_defines_percent_change_as_computed(synthetic_store):
+    result = ClimRRAnnualProjectionsCDNP().compute(synthetic_store.selection)
+    prompt = result.messages[-1]['content']
+    assert "percentage of the area's mean absolute baseline" in prompt
+    assert "each cell's baseline" not in prompt
+
+
+def test_maps_circle_the_hotspots_of_the_cached_result(synthetic_store, monkeypatch):
+    visualizer = ClimRRAnnualProjectionsCDNP()
+    result = visualizer.compute(synthetic_store.selection)
+    monkeypatch.setattr(visualizer, 'find_hotspots', lambda *args, **kwargs: pytest.fail('hotspots computed again'))
+    m = folium.Map()
+    visualizer.add_hotspots(m, synthetic_store.selection)
+    markers = [child for group in m._children.values() for child in getattr(group, '_children', {}).values()]
+    assert len(markers) == len(result.tables['hotspots']) > 0
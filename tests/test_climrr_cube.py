@@ -0,0 +1,30 @@
+import pandas as pd
+from src.data_vis.climrr_cube import ClimRRCube, parse_column
+
+PERIODS = ['hist', 'midc', 'endc']
+# seasonal columns are stored winter-first
+SEASONAL = [f'rcp{scenario}_{period}_{season}' for scenario in ['45', '85'] for period in ['midc', 'endc']
+            for season in ['winter', 'spring', 'summer', 'autumn']]
+SEASONAL = [f'hist_{season}' for season in ['winter', 'spring', 'summer', 'autumn']] + SEASONAL
+
+
+def test_parse_column():
+    assert parse_column('rcp85_midc_winter', PERIODS) == {'period': 'midc', 'season': 'winter', 'scenario': '85', 'variable': None}
+    assert parse_column('heatindex_M85_Day95', ['HIS', 'M85']) == {'period': 'M85', 'season': None, 'scenario': None, 'variable': 'Day95'}
+
+
+def test_table_puts_each_season_in_its_own_row():
+    cube = ClimRRCube(SEASONAL, PERIODS)
+    assert cube.axes['season'] == ['spring', 'summer', 'autumn', 'winter']
+    values = pd.Series(range(len(SEASONAL)), index=SEASONAL, dtype=float)
+    table = cube.table(values, 'season', 'period', scenario='85')
+    assert list(table.index) == ['spring', 'summer', 'autumn', 'winter']
+    for season in table.index:
+        assert table.loc[season, 'hist'] == values[f'hist_{season}']
+        assert table.loc[season, 'endc'] == values[f'rcp85_endc_{season}']
+
+
+def test_historical_columns_belong_to_every_scenario():
+    cube = ClimRRCube(['hist', 'rcp45_midc', 'rcp85_midc'], PERIODS)
+    assert cube.columns_where(scenario='85') == ['hist', 'rcp85_midc']
+    assert cube.changes() == [('rcp45_midc', 'hist'), ('rcp85_midc', 'hist'), ('rcp85_midc', 'rcp45_midc')]
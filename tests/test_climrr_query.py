@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from src.data_vis.climrr_query import FWI_KEYWORD, Condition, QueryEngine
+
+CDD = 'Consecutive Dry Days projections'
+
+
+@pytest.fixture
+def engine(synthetic_store):
+    """A QueryEngine over the FWI and CDD tables, the historical CDD of R1C1 missing."""
+    synthetic_store.edit(CDD, 'R1C1', hist=np.nan)
+    return QueryEngine([FWI_KEYWORD, CDD], synthetic_store.config_path)
+
+
+def test_run_accepts_selection_frame(engine, synthetic_store):
+    selection = synthetic_store.selection.iloc[::3]
+    condition = Condition(CDD, '>', 30, period='hist')
+    by_frame = engine.run(condition, selection)
+    by_ids = engine.run(condition, selection['Crossmodel'].tolist())
+    assert by_frame.total == by_ids.total == len(selection)
+    assert list(by_frame.crossmodels) == list(by_ids.crossmodels)
+    assert set(by_frame.crossmodels) <= set(selection['Crossmodel'])
+
+
+def test_fwi_class_threshold_needs_fwi_values():
+    with pytest.raises(ValueError):
+        Condition(CDD, '>=', 'High', period='hist')
+    with pytest.raises(ValueError):
+        Condition(FWI_KEYWORD, '>=', 'High', change=True, period='Endc', season='summer')
+    with pytest.raises(ValueError):
+        Condition(FWI_KEYWORD, '>=', 'Scorching', period='Endc', season='summer')
+    Condition(FWI_KEYWORD, '>=', 'High', period='Endc', season='summer')
+
+
+def test_negation_skips_missing_values(engine):
+    condition = Condition(CDD, '>', 30, period='hist')
+    matched, failed = engine.run(condition), engine.run(~condition)
+    assert 'R1C1' not in set(matched.crossmodels) | set(failed.crossmodels)
+    assert matched.count + failed.count == matched.total - 1
@@ -0,0 +1,13 @@
+from src.data_vis.climrr_cache import clear_datasets
+from src.data_vis.climrr_selection import shared_selection_loader
+
+KEYWORDS = ['Consecutive Dry Days projections', 'Wind Speed projections']
+
+
+def test_selection_loader_is_shared_until_a_dataset_reloads(synthetic_store):
+    loader = shared_selection_loader(KEYWORDS, synthetic_store.config_path)
+    tables = loader.gather(synthetic_store.selection)
+    assert shared_selection_loader(KEYWORDS, synthetic_store.config_path) is loader
+    assert loader.gather(synthetic_store.selection) is tables
+    clear_datasets()
+    assert shared_selection_loader(KEYWORDS, synthetic_store.config_path) is not loader
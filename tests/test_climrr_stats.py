@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.data_vis.climrr_pyramid import AggregatePyramid
+from src.data_vis.climrr_stats import RunningStatistics
+
+COLUMNS = ['hist', 'rcp45_midc', 'rcp85_midc', 'empty']
+
+
+@pytest.fixture
+def table():
+    """A Crossmodel-indexed table of a 40 x 40 grid and of a few cells whose IDs the pyramid cannot place, with NaNs."""
+    rng = np.random.default_rng(0)
+    ids = [f'R{row}C{col}' for row in range(1, 41) for col in range(1, 41)] + ['X1', 'X2', 'R3', 'RC4']
+    values = rng.normal(20.0, 5.0, (len(ids), len(COLUMNS)))
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[:, -1] = np.nan
+    return pd.DataFrame(values, index=pd.Index(ids, name='Crossmodel'), columns=COLUMNS)
+
+
+def selections(table):
+    """Selections of the table: blocks of the grid, scattered cells, unplaced IDs, duplicates and single cells."""
+    rng = np.random.default_rng(1)
+    ids = table.index.to_numpy()
+    grid = ids[:1600].reshape(40, 40)
+    yield grid[:32, :32].ravel()
+    yield grid[3:37, 5:29].ravel()
+    yield np.concatenate([grid[:16, :16].ravel(), ['X1', 'RC4', 'R3']])
+    yield rng.choice(ids, 500, replace=False)
+    yield np.concatenate([grid[:8, :8].ravel(), grid[:8, :8].ravel(), ['X2', 'X2']])
+    yield ids[:1]
+    yield ids
+
+
+def expected(table, ids):
+    """The statistics calculate_statistics used to return: DataFrame.mean/std over the selected cells."""
+    rows = table.loc[pd.unique(ids)]
+    return rows.mean(), rows.std()
+
+
+def assert_summary(summary, table, ids):
+    mean, std = summary
+    expected_mean, expected_std = expected(table, ids)
+    pd.testing.assert_series_equal(mean, expected_mean, check_names=False, rtol=1e-9, atol=1e-9)
+    pd.testing.assert_series_equal(std, expected_std, check_names=False, rtol=1e-9, atol=1e-9)
+
+
+def test_updates_follow_the_selection(table):
+    statistics = RunningStatistics(COLUMNS)
+    for ids in selections(table):
+        statistics.update(table, ids)
+        assert_summary(statistics.summary(), table, ids)
+
+
+def test_small_edits_add_and_remove_cells(table):
+    statistics = RunningStatistics(COLUMNS)
+    ids = table.index[:900].to_numpy()
+    statistics.update(table, ids)
+    for step in range(10):
+        ids = np.concatenate([ids[20:], table.index[900 + 20 * step:920 + 20 * step].to_numpy()])
+        statistics.update(table, ids)
+        assert_summary(statistics.summary(), table, ids)
+    statistics.update(table, ids[:1])
+    assert_summary(statistics.summary(), table, ids[:1])
+
+
+def test_pyramid_moments_match_the_selected_rows(table):
+    pyramid = AggregatePyramid(table, COLUMNS, table.index.get_indexer)
+    for ids in selections(table):
+        ids = pd.unique(ids)
+        count, total, mean, m2 = pyramid.moments(ids)
+        rows = table.loc[ids]
+        np.testing.assert_array_equal(count, rows.count().to_numpy())
+        np.testing.assert_allclose(total, rows.sum().to_numpy(), rtol=1e-9)
+        statistics = RunningStatistics(COLUMNS)
+        statistics.update(table, ids, pyramid)
+        assert_summary(statistics.summary(), table, ids)
+
+
+def test_pyramid_rejects_unknown_ids(table):
+    pyramid = AggregatePyramid(table, COLUMNS, table.index.get_indexer)
+    with pytest.raises(KeyError):
+        pyramid.moments(['R1C1', 'R99C99'])
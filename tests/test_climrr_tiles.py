@@ -0,0 +1,47 @@
+import http.server
+import threading
+import urllib.error
+import urllib.request
+from functools import partial
+import mapbox_vector_tile
+import pytest
+import shapely
+from src.data_vis.climrr_tiles import SELECTION_DIR, TILE_LAYER, TileRequestHandler, filter_tile, load_selection, register_selection
+
+
+def test_registered_selection_round_trips(tmp_path):
+    key = register_selection(['R1C2', 'R1C1', 'R1C1'], tmp_path)
+    assert key == register_selection(['R1C1', 'R1C2'], tmp_path)
+    assert load_selection(key, tmp_path) == {'R1C1', 'R1C2'}
+    assert load_selection('0' * 16, tmp_path) is None
+
+
+def test_filter_tile_keeps_selected_cells():
+    features = [{'geometry': shapely.box(i * 10, 0, i * 10 + 10, 10), 'properties': {'Crossmodel': f'R1C{i}', 'hist': float(i)}}
+                for i in range(1, 5)]
+    data = mapbox_vector_tile.encode([{'name': TILE_LAYER, 'features': features}])
+    kept = mapbox_vector_tile.decode(filter_tile(data, {'R1C2', 'R1C4'}))[TILE_LAYER]['features']
+    assert [(feature['properties']['Crossmodel'], feature['properties']['hist']) for feature in kept] == [('R1C2', 2.0), ('R1C4', 4.0)]
+    assert filter_tile(data, {'R9C9'}) == b''
+
+
+def test_tile_server_only_serves_selected_tiles(tmp_path):
+    features = [{'geometry': shapely.box(0, 0, 10, 10), 'properties': {'Crossmodel': 'R1C1'}},
+                {'geometry': shapely.box(10, 0, 20, 10), 'properties': {'Crossmodel': 'R1C2'}}]
+    (tmp_path / 'cells' / '4' / '3').mkdir(parents=True)
+    (tmp_path / 'cells' / '4' / '3' / '5.pbf').write_bytes(mapbox_vector_tile.encode([{'name': TILE_LAYER, 'features': features}]))
+    key = register_selection(['R1C2'], tmp_path)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(TileRequestHandler, directory=str(tmp_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        tile = mapbox_vector_tile.decode(urllib.request.urlopen(f'{url}/cells/{key}/4/3/5.pbf').read())
+        assert [feature['properties']['Crossmodel'] for feature in tile[TILE_LAYER]['features']] == ['R1C2']
+        assert urllib.request.urlopen(f'{url}/cells/{key}/4/3/6.pbf').read() == b''
+        for path in ['/cells/4/3/5.pbf', f'/{SELECTION_DIR}/{key}.txt', '/', '/cells/', f'/cells/{"0" * 16}/4/3/5.pbf']:
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + path)
+            assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,51 @@
+import matplotlib.colors as mcolors
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+from src.data_vis.climrr_utils import (categorize_fwi, categorize_fwi_array, colormap_hex, convert_to_dataframe, fwi_color,
+                                       fwi_colors, index_by_crossmodel, top_k)
+
+
+def test_top_k_orders_from_most_extreme():
+    values = [3, 1, 2, np.nan]
+    assert list(top_k(values, 2)) == [0, 2]
+    assert list(top_k(values, 5, largest=False)) == [1, 2, 0]
+
+
+def test_top_k_of_zero_is_empty():
+    assert len(top_k([3, 1, 2, np.nan], 0)) == 0
+    assert len(top_k([3, 1, 2], -1)) == 0
+
+
+def gather_row_by_row(df, values_of_interests, crossmodels):
+    """The former convert_to_dataframe: the first row of each selected ID, in the order of the selection."""
+    rows = {}
+    for crossmodel in crossmodels['Crossmodel']:
+        rows[crossmodel] = df[df['Crossmodel'] == crossmodel].iloc[0]
+    return pd.DataFrame([[crossmodel] + [row[col] for col in values_of_interests] for crossmodel, row in rows.items()],
+                        columns=['Crossmodel'] + values_of_interests)
+
+
+def test_convert_to_dataframe_matches_row_by_row_gathering():
+    df = pd.DataFrame({'Crossmodel': ['R1C1', 'R1C2', 'R2C1', 'R1C2', 'R2C2'],
+                       'hist': [1.0, 2.0, np.nan, 9.0, 4.0], 'rcp85_endc': [5.0, 6.0, 7.0, 9.0, 8.0], 'other': 0.0})
+    crossmodels = pd.DataFrame({'Crossmodel': ['R2C2', 'R1C2', 'R2C1', 'R2C2']})
+    expected = gather_row_by_row(df, ['hist', 'rcp85_endc'], crossmodels)
+    pd.testing.assert_frame_equal(convert_to_dataframe(df, ['hist', 'rcp85_endc'], crossmodels), expected)
+    pd.testing.assert_frame_equal(convert_to_dataframe(index_by_crossmodel(df), ['hist', 'rcp85_endc'], crossmodels), expected)
+    with pytest.raises(KeyError):
+        convert_to_dataframe(df, ['hist'], pd.DataFrame({'Crossmodel': ['R9C9']}))
+
+
+def test_fwi_colors_match_scalar_classes():
+    values = [-1.0, 0.0, 9.0, 9.01, 21.0, 21.5, 34.0, 34.2, 39.0, 39.9, 53.0, 53.1, 80.0, np.nan]
+    assert list(categorize_fwi_array(values)) == [categorize_fwi(value) for value in values]
+    assert list(fwi_colors(values)) == [fwi_color(value) for value in values]
+
+
+@pytest.mark.parametrize('name', ['YlOrBr', 'coolwarm', 'viridis'])
+def test_colormap_hex_matches_rgb2hex(name):
+    color_scale = plt.get_cmap(name)
+    values = np.concatenate([np.linspace(-0.1, 1.1, 241), [np.nan]])
+    assert list(colormap_hex(color_scale, values)) == [mcolors.rgb2hex(color_scale(value)) for value in values]